@@ -9,6 +9,8 @@ from config import Config
 from database import db
 from script import script
 from utils import get_size
+from progress import reporter
+from spool import memory_pool
 
 # Initialize bot
 bot = Client(
@@ -293,38 +295,55 @@ async def rename_file(client, message):
     status_msg = await message.reply("⏳ <b>Processing your file...</b>")
     
     try:
-        # Download file
-        await status_msg.edit("📥 <b>Downloading file...</b>")
-        file_path = await original_message.download()
+        # Small files stay in memory (within the global cap), others go to disk
+        file_size = file_data['file_size']
+        in_memory = file_size <= Config.MEMORY_RENAME_MAX and memory_pool.try_reserve(file_size)
         
-        # Rename file
-        new_path = os.path.join(os.path.dirname(file_path), new_name)
-        os.rename(file_path, new_path)
-        
-        # Upload file
-        await status_msg.edit("📤 <b>Uploading renamed file...</b>")
-        
-        if upload_as_doc:
-            await message.reply_document(
-                document=new_path,
-                thumb=thumb,
-                caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
-                progress=progress_callback,
-                progress_args=(status_msg,)
-            )
-        else:
-            await message.reply_video(
-                video=new_path,
-                thumb=thumb,
-                caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
-                progress=progress_callback,
-                progress_args=(status_msg,)
-            )
+        try:
+            # Download file
+            await status_msg.edit("📥 <b>Downloading file...</b>")
+            if in_memory:
+                media = await original_message.download(in_memory=True)
+                if media is None:
+                    raise IOError("Download failed")
+                
+                # Rename file - a buffer is uploaded under its name
+                media.name = new_name
+            else:
+                file_path = await original_message.download()
+                
+                # Rename file
+                media = os.path.join(os.path.dirname(file_path), new_name)
+                os.rename(file_path, media)
+            
+            # Upload file
+            await status_msg.edit("📤 <b>Uploading renamed file...</b>")
+            
+            if upload_as_doc:
+                await message.reply_document(
+                    document=media,
+                    thumb=thumb,
+                    caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
+                    progress=progress_callback,
+                    progress_args=(status_msg,)
+                )
+            else:
+                await message.reply_video(
+                    video=media,
+                    thumb=thumb,
+                    caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
+                    progress=progress_callback,
+                    progress_args=(status_msg,)
+                )
+        finally:
+            if in_memory:
+                memory_pool.release(file_size)
         
         await status_msg.delete()
         
         # Clean up
-        os.remove(new_path)
+        if not in_memory:
+            os.remove(media)
         del user_files[user_id]
         
     except Exception as e:
@@ -334,11 +353,7 @@ async def rename_file(client, message):
 
 async def progress_callback(current, total, status_msg):
     """Progress callback for file upload"""
-    try:
-        percent = (current / total) * 100
-        await status_msg.edit(f"📤 <b>Uploading:</b> {percent:.1f}%")
-    except:
-        pass
+    await reporter.update(status_msg, "📤 Uploading...", current, total)
 
 # Callback query handlers
 @bot.on_callback_query()
@@ -46,7 +46,71 @@ class Config:
     WORKERS = 100
     SLEEP_THRESHOLD = 60
     DOWNLOAD_LOCATION = "/tmp/downloads/"  # Use /tmp for Render
-    CHUNK_SIZE = 512 * 1024  # 512KB chunks
-    PROGRESS_UPDATE_DELAY = 2  # Update every 2 seconds
+    SPOOL_BUDGET = 20 * 1024 * 1024 * 1024  # 20GB - max bytes reserved under DOWNLOAD_LOCATION
+    SPOOL_MIN_FREE = 1024 * 1024 * 1024  # 1GB - always leave this much disk free
+    SPOOL_WAIT_TIMEOUT = 30 * 60  # Seconds a download may wait for disk space
+    RESUME_DOWNLOADS = True  # Keep partial downloads (with a .parts checkpoint) for retries
+    RESUME_MAX_AGE = 6 * 60 * 60  # Partial downloads older than this are cleaned up on start
+    THUMB_CACHE_DIR = "/tmp/thumbs/"  # Pre-resized user thumbnails (kept out of DOWNLOAD_LOCATION)
+    THUMB_CACHE_MAX = 200 * 1024 * 1024  # 200MB - least recently used thumbnails are evicted past this
+    THUMB_MAX_SIDE = 320  # Telegram thumbnail limit (pixels)
+    THUMB_MAX_BYTES = 200 * 1024  # Telegram thumbnail limit (200KB)
+    THUMB_WORKERS = 1  # Processes used to resize thumbnails
+    CHUNK_SIZE = 1024 * 1024  # 1MB - the chunk size stream_media fetches per request
+    DOWNLOAD_CONNECTIONS = 6  # Byte ranges fetched in parallel per download
+    MAX_CONCURRENT_TRANSMISSIONS = 50  # Client-wide cap on open media sessions
+    PROGRESS_UPDATE_DELAY = 3  # Minimum seconds between edits of one progress message
+    PROGRESS_EDITS_PER_SECOND = 15  # Bot-wide budget for progress message edits
+    PROGRESS_SPEED_WINDOW = 10  # Seconds of samples averaged for speed and ETA
     SESSION_NAME = "bot_session"
     WORKDIR = "/tmp"  # Use /tmp for session files on Render
+    
+    # Streaming Rename Pipeline
+    STREAM_RENAME = True  # Pipe download chunks straight into the uploader (no disk spool)
+    STREAM_BUFFER_PARTS = 16  # 512KB parts buffered between download and upload (8MB)
+    STREAM_RANGE_CHUNKS = 4  # Chunks per range when a stream is fetched over several sessions
+    UPLOAD_WORKERS = 8  # Parts in flight per upload
+    UPLOAD_SESSIONS = 4  # Media sessions a big upload is spread over
+    UPLOAD_READ_AHEAD = 8  # Parts read from disk per read when uploading a local file
+    UPLOAD_PART_RETRIES = 5  # Attempts per part before the upload fails
+    MEMORY_RENAME_MAX = 20 * 1024 * 1024  # 20MB - smaller files are renamed entirely in memory
+    MEMORY_RENAME_BUDGET = 256 * 1024 * 1024  # 256MB - total held in memory at once, others use disk
+    PROBE_MAX_HEADER = 32 * 1024 * 1024  # Largest moov / Matroska header read to find video attributes
+    
+    # Helper Bots (optional) - extra bot tokens that carry transfers. All of
+    # them, and the main bot, must be admins of BIN_CHANNEL
+    HELPER_TOKENS = os.environ.get("HELPER_TOKENS", "").split()  # Space separated
+    BIN_CHANNEL = int(os.environ.get("BIN_CHANNEL", 0))  # Channel used to relay files between bots
+    
+    # User Cache
+    USER_CACHE_SIZE = 10000  # Users kept in the in-process profile cache (LRU)
+    USER_CACHE_TTL = 60  # Seconds before a cached profile is read from MongoDB again
+    
+    USER_WRITE_BEHIND = False  # Buffer new users from /start and insert them in batches
+    USER_FLUSH_INTERVAL = 2  # Max seconds a buffered new user waits before being written
+    USER_FLUSH_BATCH = 500  # Buffered users that trigger an immediate flush
+    
+    # Broadcast Pacing
+    BROADCAST_RATE = 25  # Max messages per second (Telegram allows bots about 30)
+    BROADCAST_MIN_RATE = 3  # Rate never drops below this after FloodWaits
+    BROADCAST_RATE_STEP_AFTER = 300  # Successes in a row before the rate goes up by 1/s
+    BROADCAST_PRUNE_BATCH = 500  # Blocked/deleted users tombstoned per bulk write
+    
+    # Persistent Rename Jobs
+    JOB_LEASE = 60  # Seconds a job stays owned by a process without a heartbeat
+    JOB_MAX_ATTEMPTS = 3  # Interrupted jobs are retried this many times in total
+    JOB_RETENTION = 24 * 60 * 60  # Seconds finished (done / failed) jobs are kept before MongoDB deletes them
+    EXTERNAL_WORKERS = False  # Only queue jobs here, `python main.py --worker` processes run them
+    WORKER_POLL_INTERVAL = 2  # Seconds between a worker's checks for new jobs
+    
+    # Rename Result Cache
+    RENAME_CACHE = True  # Resend an identical earlier rename instead of re-transferring
+    RENAME_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds an unused cache entry stays valid
+    RENAME_CACHE_MAX = 50000  # Least recently used entries beyond this are evicted
+    
+    # Rename Job Scheduler
+    MAX_CONCURRENT_JOBS = 5  # Renames running at once across all users
+    MAX_INFLIGHT_BYTES = 12 * 1024 * 1024 * 1024  # 12GB - total size of running renames
+    QUEUE_UPDATE_INTERVAL = 10  # Seconds between queue position checks
+    PREMIUM_LANE_WEIGHT = 3  # Premium jobs started (and bandwidth share) per free job under load
+    FREE_LANE_WEIGHT = 1
@@ -1,27 +1,236 @@
+import time
+import logging
+import datetime
+import asyncio
+import hashlib
+from collections import OrderedDict
 import motor.motor_asyncio
+from pymongo import ReturnDocument, UpdateOne
 from config import Config
 
+logger = logging.getLogger(__name__)
+
 class Database:
     def __init__(self, uri):
         self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
         self.db = self._client['RenameBot']
         self.users = self.db['users']
         self.chats = self.db['chats']
+        self.rename_cache = self.db['rename_cache']
+        self.jobs = self.db['jobs']
+        self.meta = self.db['meta']
+        self.broadcasts = self.db['broadcasts']
+        
+        # Read-through user cache: user_id -> (cached_at, document or None)
+        self.user_cache = OrderedDict()
+        self.user_cache_generation = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        # Write-behind buffer of new users: user_id -> document
+        self.pending_users = {}
+        self.flush_task = None
+
+    # Schema Migrations and Indexes
+    async def _dedupe(self, collection):
+        """Merge documents sharing an id into the oldest one (later non-null
+        fields win) so a unique index on id can be built"""
+        duplicates = collection.aggregate([
+            {'$group': {'_id': '$id', 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}
+        ], allowDiskUse=True)
+
+        merged = 0
+        async for group in duplicates:
+            docs = [doc async for doc in collection.find({'id': group['_id']}).sort('_id', 1)]
+            keep = docs[0]
+            fields = {}
+            for doc in docs:
+                fields.update({key: value for key, value in doc.items() if key != '_id' and value is not None})
+            await collection.update_one({'_id': keep['_id']}, {'$set': fields})
+            await collection.delete_many({'_id': {'$in': [doc['_id'] for doc in docs[1:]]}})
+            merged += len(docs) - 1
+        logger.info(f"Merged {merged} duplicate document(s) in {collection.name}")
+
+    async def _migrate_dedupe_users(self):
+        await self._dedupe(self.users)
+
+    async def _migrate_dedupe_chats(self):
+        await self._dedupe(self.chats)
+
+    async def _migrate_drop_checkpoints(self):
+        # Download progress lives only in the .parts sidecar next to the file
+        await self.db.drop_collection('checkpoints')
+
+    async def _migrate_partial_expiry_index(self):
+        # The sparse index also held every expiry_time: None
+        if 'expiry_time_1' in await self.users.index_information():
+            await self.users.drop_index('expiry_time_1')
+
+    async def _migrate_finished_jobs(self):
+        # Give jobs finished before the TTL index existed an expiry time too
+        await self.jobs.update_many(
+            {'state': {'$in': list(self.FINISHED_JOB_STATES)}, 'finished_at': {'$exists': False}},
+            [{'$set': {'finished_at': '$updated_at'}}]
+        )
+
+    def _migrations(self):
+        """(version, migration) pairs, applied in order and never twice.
+        Append new ones with the next version number."""
+        return [
+            (1, self._migrate_dedupe_users),
+            (2, self._migrate_dedupe_chats),
+            (3, self._migrate_drop_checkpoints),
+            (4, self._migrate_partial_expiry_index),
+            (5, self._migrate_finished_jobs),
+        ]
+
+    async def migrate(self):
+        schema = await self.meta.find_one({'_id': 'schema'})
+        version = schema['version'] if schema else 0
+        for number, migration in self._migrations():
+            if number <= version:
+                continue
+            logger.info(f"Running database migration {number}: {migration.__name__}")
+            await migration()
+            await self.meta.update_one({'_id': 'schema'}, {'$set': {'version': number}}, upsert=True)
+
+    async def ensure_indexes(self):
+        await self.users.create_index('id', unique=True)
+        # Only users with a premium expiry date set
+        await self.users.create_index('expiry_time', partialFilterExpression={'expiry_time': {'$type': 'date'}})
+        await self.chats.create_index('id', unique=True)
+        await self.jobs.create_index([('state', 1), ('lease_until', 1)])
+        await self.jobs.create_index([('owner', 1), ('state', 1)])
+        # Finished jobs are deleted by MongoDB JOB_RETENTION seconds later
+        await self.jobs.create_index('finished_at', expireAfterSeconds=Config.JOB_RETENTION)
+        await self.rename_cache.create_index('last_used')
+
+    async def bootstrap(self):
+        """Run pending migrations, then make sure every index exists"""
+        await self.migrate()
+        await self.ensure_indexes()
+
+    # User Cache
+    def _cached_user(self, user_id):
+        entry = self.user_cache.get(user_id)
+        if entry is None:
+            return False, None
+        if time.monotonic() - entry[0] > Config.USER_CACHE_TTL:
+            del self.user_cache[user_id]
+            return False, None
+        self.user_cache.move_to_end(user_id)
+        return True, entry[1]
+
+    def _cache_user(self, user_id, user, generation):
+        # Skip results that a write may have made stale while they were in flight
+        if generation != self.user_cache_generation:
+            return
+        self.user_cache[user_id] = (time.monotonic(), user)
+        self.user_cache.move_to_end(user_id)
+        while len(self.user_cache) > Config.USER_CACHE_SIZE:
+            self.user_cache.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        self.user_cache.pop(user_id, None)
+        self.user_cache_generation += 1
+
+    def user_cache_stats(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'size': len(self.user_cache),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_rate': self.cache_hits / lookups if lookups else 0
+        }
 
     # User Management
+    def _new_user(self, user_id, user_name):
+        return {
+            'id': user_id,
+            'name': user_name,
+            'expiry_time': None,
+            'thumbnail': None,
+            'upload_as_doc': True  # Default: upload as document
+        }
+
     async def add_user(self, user_id, user_name):
-        user = await self.users.find_one({'id': user_id})
-        if not user:
-            await self.users.insert_one({
-                'id': user_id,
-                'name': user_name,
-                'expiry_time': None,
-                'thumbnail': None,
-                'upload_as_doc': True  # Default: upload as document
-            })
+        """Insert the user unless they exist - one atomic upsert, so concurrent
+        /starts can't create duplicates. Known cached users cost nothing."""
+        found, user = self._cached_user(user_id)
+        if found and user and not user.get('inactive'):
+            return
+
+        if Config.USER_WRITE_BEHIND:
+            self._buffer_user(user_id, user_name)
+            return
+
+        # A user pruned as blocked who comes back is reactivated
+        result = await self.users.update_one(
+            {'id': user_id},
+            {'$setOnInsert': self._new_user(user_id, user_name), '$unset': {'inactive': ''}},
+            upsert=True
+        )
+        if result.upserted_id or result.modified_count:
+            self.invalidate_user(user_id)
+
+    def _buffer_user(self, user_id, user_name):
+        """Queue a new user for the next bulk write. The buffer is flushed
+        USER_FLUSH_INTERVAL seconds after its first entry, or at once when it
+        reaches USER_FLUSH_BATCH users."""
+        self.pending_users.setdefault(user_id, self._new_user(user_id, user_name))
+        if len(self.pending_users) >= Config.USER_FLUSH_BATCH:
+            self._schedule_flush(0)
+        elif self.flush_task is None:
+            self._schedule_flush(Config.USER_FLUSH_INTERVAL)
+
+    def _schedule_flush(self, delay):
+        if self.flush_task and not self.flush_task.done():
+            if delay:
+                return
+            self.flush_task.cancel()
+
+        async def flush_later():
+            await asyncio.sleep(delay)
+            self.flush_task = None
+            await self.flush_users()
+
+        self.flush_task = asyncio.create_task(flush_later())
+
+    async def flush_users(self):
+        """Write every buffered new user with one unordered bulk_write"""
+        if not self.pending_users:
+            return
+        batch, self.pending_users = self.pending_users, {}
+        try:
+            await self.users.bulk_write(
+                [
+                    UpdateOne({'id': user_id}, {'$setOnInsert': doc, '$unset': {'inactive': ''}}, upsert=True)
+                    for user_id, doc in batch.items()
+                ],
+                ordered=False
+            )
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} buffered user(s): {e}")
+            # Put them back for the next flush
+            for user_id, doc in batch.items():
+                self.pending_users.setdefault(user_id, doc)
+            if self.flush_task is None:
+                self._schedule_flush(Config.USER_FLUSH_INTERVAL)
+        for user_id in batch:
+            self.invalidate_user(user_id)
 
     async def get_user(self, user_id):
-        return await self.users.find_one({'id': user_id})
+        """User document (a copy), served from the user cache when fresh"""
+        found, user = self._cached_user(user_id)
+        if found:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            generation = self.user_cache_generation
+            user = await self.users.find_one({'id': user_id})
+            self._cache_user(user_id, user, generation)
+        return dict(user) if user else None
 
     async def update_user(self, user_data):
         await self.users.update_one(
@@ -29,6 +238,22 @@ class Database:
             {'$set': user_data},
             upsert=True
         )
+        self.invalidate_user(user_data['id'])
+
+    async def get_rename_context(self, user_id):
+        """Everything a rename needs about a user: premium flag, size limit,
+        upload mode and thumbnail file_id. Read through the user cache, so a
+        user's renames after the first one don't touch the database."""
+        user = await self.get_user(user_id) or {}
+        
+        expiry = user.get('expiry_time')
+        premium = bool(expiry and expiry > datetime.datetime.now())
+        return {
+            'premium': premium,
+            'limit': Config.PREMIUM_USER_LIMIT if premium else Config.FREE_USER_LIMIT,
+            'upload_as_doc': user.get('upload_as_doc', True),
+            'thumb_id': user.get('thumbnail')
+        }
 
     async def remove_premium_access(self, user_id):
         user = await self.get_user(user_id)
@@ -37,17 +262,51 @@ class Database:
                 {'id': user_id},
                 {'$set': {'expiry_time': None}}
             )
+            self.invalidate_user(user_id)
             return True
         return False
 
     async def get_all_users(self):
         return self.users.find({})
 
+    # Users pruned by a broadcast are kept (premium, settings) but tombstoned
+    ACTIVE_USERS = {'inactive': {'$ne': True}}
+
+    def iter_user_ids(self, batch_size=500, after=None):
+        """Cursor over just the _id and id of every active user, in _id order,
+        fetched batch_size documents per round trip. With after, it starts
+        right past that _id (a broadcast checkpoint)."""
+        query = dict(self.ACTIVE_USERS)
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        return self.users.find(query, {'id': 1}).sort('_id', 1).batch_size(batch_size)
+
+    async def prune_users(self, dead):
+        """Tombstone unreachable users in one unordered bulk_write.
+        dead maps user id -> reason ('Blocked' or 'Deleted')."""
+        if not dead:
+            return
+        now = datetime.datetime.now()
+        await self.users.bulk_write(
+            [
+                UpdateOne({'id': user_id}, {'$set': {'inactive': True, 'inactive_reason': reason, 'inactive_at': now}})
+                for user_id, reason in dead.items()
+            ],
+            ordered=False
+        )
+        for user_id in dead:
+            self.invalidate_user(user_id)
+
+    async def get_premium_users(self):
+        """Users with an expiry_time set (served by the partial expiry_time index)"""
+        return self.users.find({'expiry_time': {'$type': 'date'}})
+
     async def total_users_count(self):
-        return await self.users.count_documents({})
+        return await self.users.count_documents(self.ACTIVE_USERS)
 
     async def delete_user(self, user_id):
         await self.users.delete_one({'id': user_id})
+        self.invalidate_user(user_id)
 
     # Thumbnail Management
     async def set_thumbnail(self, user_id, file_id):
@@ -56,6 +315,7 @@ class Database:
             {'$set': {'thumbnail': file_id}},
             upsert=True
         )
+        self.invalidate_user(user_id)
 
     async def get_thumbnail(self, user_id):
         user = await self.get_user(user_id)
@@ -66,6 +326,7 @@ class Database:
             {'id': user_id},
             {'$set': {'thumbnail': None}}
         )
+        self.invalidate_user(user_id)
 
     # Upload Settings
     async def set_upload_mode(self, user_id, upload_as_doc):
@@ -74,11 +335,173 @@ class Database:
             {'$set': {'upload_as_doc': upload_as_doc}},
             upsert=True
         )
+        self.invalidate_user(user_id)
 
     async def get_upload_mode(self, user_id):
         user = await self.get_user(user_id)
         return user.get('upload_as_doc', True) if user else True
 
+    # Rename Result Cache
+    def _rename_cache_key(self, file_unique_id, new_name, thumb_id, upload_as_doc):
+        raw_key = f"{file_unique_id}|{new_name}|{thumb_id or ''}|{int(bool(upload_as_doc))}"
+        return hashlib.sha1(raw_key.encode()).hexdigest()
+
+    async def get_cached_rename(self, file_unique_id, new_name, thumb_id, upload_as_doc):
+        """Return the output file_id of an identical earlier rename, if still fresh"""
+        now = datetime.datetime.now()
+        entry = await self.rename_cache.find_one_and_update(
+            {
+                '_id': self._rename_cache_key(file_unique_id, new_name, thumb_id, upload_as_doc),
+                'last_used': {'$gte': now - datetime.timedelta(seconds=Config.RENAME_CACHE_TTL)}
+            },
+            {'$set': {'last_used': now}, '$inc': {'hits': 1}}
+        )
+        return entry['file_id'] if entry else None
+
+    async def cache_rename(self, file_unique_id, new_name, thumb_id, upload_as_doc, file_id):
+        now = datetime.datetime.now()
+        await self.rename_cache.update_one(
+            {'_id': self._rename_cache_key(file_unique_id, new_name, thumb_id, upload_as_doc)},
+            {
+                '$set': {
+                    'source': file_unique_id,
+                    'new_name': new_name,
+                    'thumbnail': thumb_id,
+                    'upload_as_doc': upload_as_doc,
+                    'file_id': file_id,
+                    'last_used': now
+                },
+                '$setOnInsert': {'hits': 0}
+            },
+            upsert=True
+        )
+
+        # TTL: drop stale entries, LRU: keep at most RENAME_CACHE_MAX
+        await self.rename_cache.delete_many(
+            {'last_used': {'$lt': now - datetime.timedelta(seconds=Config.RENAME_CACHE_TTL)}}
+        )
+        excess = await self.rename_cache.estimated_document_count() - Config.RENAME_CACHE_MAX
+        if excess > 0:
+            oldest = self.rename_cache.find({}, {'_id': 1}).sort('last_used', 1).limit(excess)
+            await self.rename_cache.delete_many({'_id': {'$in': [entry['_id'] async for entry in oldest]}})
+
+    async def invalidate_cached_rename(self, file_unique_id, new_name, thumb_id, upload_as_doc):
+        await self.rename_cache.delete_one(
+            {'_id': self._rename_cache_key(file_unique_id, new_name, thumb_id, upload_as_doc)}
+        )
+
+    # Rename Jobs
+    ACTIVE_JOB_STATES = ['queued', 'downloading', 'uploading']
+    FINISHED_JOB_STATES = ('done', 'failed')
+
+    async def create_job(self, job, owner, lease):
+        """Store a queued rename job, returns its _id. With owner None the job
+        is left unleased for any worker to claim."""
+        now = datetime.datetime.now()
+        result = await self.jobs.insert_one({
+            **job,
+            'state': 'queued',
+            'attempts': 1 if owner else 0,
+            'owner': owner,
+            'lease_until': now + datetime.timedelta(seconds=lease) if owner else now,
+            'created_at': now,
+            'updated_at': now
+        })
+        return result.inserted_id
+
+    async def set_job_state(self, job_id, state, **fields):
+        now = datetime.datetime.now()
+        if state in self.FINISHED_JOB_STATES:
+            # Starts the TTL index's clock (TTL expiry is compared in UTC)
+            fields['finished_at'] = datetime.datetime.now(datetime.timezone.utc)
+        await self.jobs.update_one(
+            {'_id': job_id},
+            {'$set': {**fields, 'state': state, 'updated_at': now}}
+        )
+
+    async def renew_job_leases(self, owner, lease):
+        """Extend the lease of every unfinished job owned by owner"""
+        await self.jobs.update_many(
+            {'owner': owner, 'state': {'$in': self.ACTIVE_JOB_STATES}},
+            {'$set': {'lease_until': datetime.datetime.now() + datetime.timedelta(seconds=lease)}}
+        )
+
+    async def claim_job(self, owner, lease):
+        """Atomically lease the next unowned or abandoned job to owner.
+
+        Premium jobs first, then oldest first. A single find_one_and_update
+        means concurrent workers never get the same job.
+        """
+        now = datetime.datetime.now()
+        return await self.jobs.find_one_and_update(
+            {'state': {'$in': self.ACTIVE_JOB_STATES}, 'lease_until': {'$lt': now}},
+            {
+                '$set': {
+                    'owner': owner,
+                    'state': 'queued',
+                    'lease_until': now + datetime.timedelta(seconds=lease),
+                    'updated_at': now
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('premium', -1), ('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def claim_interrupted_jobs(self, owner, lease):
+        """Take over every unfinished job whose owner stopped renewing its lease"""
+        claimed = []
+        while True:
+            job = await self.claim_job(owner, lease)
+            if not job:
+                return claimed
+            claimed.append(job)
+
+    # Broadcast Runs
+    async def create_broadcast(self, run):
+        """Store a running broadcast, returns its _id"""
+        now = datetime.datetime.now()
+        result = await self.broadcasts.insert_one({
+            **run,
+            'state': 'running',
+            'last_id': None,
+            'counters': {'done': 0, 'success': 0, 'blocked': 0, 'deleted': 0, 'failed': 0},
+            'created_at': now,
+            'updated_at': now
+        })
+        return result.inserted_id
+
+    async def checkpoint_broadcast(self, run_id, last_id, counters):
+        """Record the last user _id reached and the counters so far"""
+        await self.broadcasts.update_one(
+            {'_id': run_id},
+            {'$set': {'last_id': last_id, 'counters': counters, 'updated_at': datetime.datetime.now()}}
+        )
+
+    async def set_broadcast_state(self, run_id, state):
+        await self.broadcasts.update_one(
+            {'_id': run_id},
+            {'$set': {'state': state, 'updated_at': datetime.datetime.now()}}
+        )
+
+    async def claim_broadcast(self, run_id):
+        """Atomically flip an interrupted run back to running, so a run is
+        resumed at most once. Returns the run, or None if it isn't pending."""
+        return await self.broadcasts.find_one_and_update(
+            {'_id': run_id, 'state': 'interrupted'},
+            {'$set': {'state': 'running', 'updated_at': datetime.datetime.now()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def interrupt_broadcasts(self):
+        """Mark runs left 'running' by a previous process as interrupted and
+        return every interrupted run, oldest first"""
+        await self.broadcasts.update_many(
+            {'state': 'running'},
+            {'$set': {'state': 'interrupted', 'updated_at': datetime.datetime.now()}}
+        )
+        return await self.broadcasts.find({'state': 'interrupted'}).sort('created_at', 1).to_list(None)
+
     # Chat Management
     async def add_chat(self, chat_id, chat_name):
         chat = await self.chats.find_one({'id': chat_id})
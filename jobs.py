@@ -0,0 +1,45 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from config import Config
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process as the owner of the jobs it runs
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+maintenance_tasks = set()
+
+
+async def maintain_jobs(recover, interval=None):
+    """Keep this process's job leases alive and adopt jobs whose owner died.
+
+    Leases are renewed every JOB_LEASE / 3 seconds; recover() runs right
+    away and then every interval seconds (JOB_LEASE by default), so jobs of
+    a crashed process (or of the previous deploy) are picked up once their
+    lease has run out. Workers pass a short interval to poll for new jobs.
+    """
+    interval = interval or Config.JOB_LEASE
+    last_renewal = last_recovery = None
+    while True:
+        try:
+            if last_renewal is None or time.monotonic() - last_renewal >= Config.JOB_LEASE / 3:
+                last_renewal = time.monotonic()
+                await db.renew_job_leases(WORKER_ID, Config.JOB_LEASE)
+            if last_recovery is None or time.monotonic() - last_recovery >= interval:
+                last_recovery = time.monotonic()
+                await recover()
+        except Exception as e:
+            logger.error(f"Job maintenance failed: {e}")
+        await asyncio.sleep(min(interval, Config.JOB_LEASE / 3))
+
+
+def start_job_maintenance(recover, interval=None):
+    task = asyncio.create_task(maintain_jobs(recover, interval))
+    maintenance_tasks.add(task)
+    task.add_done_callback(maintenance_tasks.discard)
+    return task
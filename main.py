@@ -1,10 +1,15 @@
 import os
+import sys
 import asyncio
 import datetime
 import logging
-from pyrogram import Client
+from pyrogram import Client, idle
 from pyrogram.errors import FloodWait
 from config import Config
+from spool import spool
+from pool import client_pool
+from database import db
+from jobs import start_job_maintenance
 from threading import Thread
 from flask import Flask
 
@@ -21,6 +26,7 @@ def setup_directories():
     directories = [
         Config.WORKDIR,
         Config.DOWNLOAD_LOCATION,
+        Config.THUMB_CACHE_DIR,
     ]
     for directory in directories:
         try:
@@ -56,6 +62,7 @@ app = Client(
     workers=Config.WORKERS,
     workdir=Config.WORKDIR,
     sleep_threshold=Config.SLEEP_THRESHOLD,
+    max_concurrent_transmissions=Config.MAX_CONCURRENT_TRANSMISSIONS,
     
     plugins=dict(root="plugins")
 )
@@ -66,9 +73,17 @@ async def start_bot():
         await app.start()
         me = await app.get_me()
         
+        # Migrate old data and make sure every index exists
+        try:
+            await db.bootstrap()
+        except Exception as e:
+            logger.error(f"Database bootstrap failed: {e}")
+        
         logger.info(f"✅ Bot started as @{me.username}")
         logger.info(f"⚡ Workers: {Config.WORKERS}")
         logger.info(f"⚡ Sleep Threshold: {Config.SLEEP_THRESHOLD}s")
+        logger.info(f"⚡ Download Connections: {Config.DOWNLOAD_CONNECTIONS}")
+        logger.info(f"⚡ Helper Bots: {len(client_pool.helpers)}")
         logger.info(f"📁 Work Directory: {Config.WORKDIR}")
         logger.info(f"📁 Download Location: {Config.DOWNLOAD_LOCATION}")
         logger.info(f"📊 Free User Limit: {Config.FREE_USER_LIMIT / (1024**3):.1f}GB")
@@ -97,6 +112,16 @@ async def start_bot():
                     await app.send_message(admin, startup_msg)
                 except Exception as e:
                     logger.error(f"Failed to send startup message to {admin}: {e}")
+        
+        # Offer to resume broadcasts cut off by the last shutdown
+        from plugins.broadcast import offer_broadcast_resume
+        await offer_broadcast_resume(app)
+        
+        # Keep our job leases alive and requeue jobs interrupted by the last shutdown
+        # (with external workers they run and recover every job instead)
+        if not Config.EXTERNAL_WORKERS:
+            from plugins.rename import recover_jobs
+            start_job_maintenance(lambda: recover_jobs(app))
     
     except FloodWait as e:
         logger.warning(f"FloodWait: Sleeping for {e.value} seconds...")
@@ -107,6 +132,43 @@ async def start_bot():
         logger.error(f"Error starting bot: {e}")
         raise
 
+async def run_bot():
+    """Start, run until stopped, then shut down cleanly"""
+    await start_bot()
+    await idle()
+    await stop_bot()
+
+def create_worker():
+    """Transfer-only session of the same bot - no plugins, no updates, so any
+    number of workers can run next to the front-end without duplicate handlers"""
+    return Client(
+        f"{Config.SESSION_NAME}_worker",
+        api_id=Config.API_ID,
+        api_hash=Config.API_HASH,
+        bot_token=Config.BOT_TOKEN,
+        in_memory=True,
+        no_updates=True,
+        workdir=Config.WORKDIR,
+        sleep_threshold=Config.SLEEP_THRESHOLD,
+        max_concurrent_transmissions=Config.MAX_CONCURRENT_TRANSMISSIONS
+    )
+
+async def run_worker():
+    """Worker mode - lease rename jobs from the shared queue and run them"""
+    from plugins.rename import claim_jobs
+    
+    worker = create_worker()
+    await worker.start()
+    logger.info(f"✅ Worker started ({Config.MAX_CONCURRENT_JOBS} jobs at a time)")
+    
+    # Same bot identity, so the job's message ids and file ids are valid here
+    # and progress goes straight into the front-end's status messages
+    start_job_maintenance(lambda: claim_jobs(worker), interval=Config.WORKER_POLL_INTERVAL)
+    
+    await idle()
+    await client_pool.stop()
+    await worker.stop()
+
 async def stop_bot():
     """Stop bot gracefully"""
     try:
@@ -119,6 +181,8 @@ async def stop_bot():
                 except:
                     pass
         
+        await client_pool.stop()
+        await db.flush_users()
         await app.stop()
         logger.info("✅ Bot stopped successfully!")
     
@@ -140,6 +204,18 @@ if __name__ == "__main__":
     print("📁 Setting up directories...")
     setup_directories()
     
+    # Worker processes only run jobs queued by the front-end
+    if "--worker" in sys.argv:
+        print("🛠 Starting in worker mode...")
+        asyncio.get_event_loop().run_until_complete(run_worker())
+        sys.exit(0)
+    
+    # Remove downloads left behind by a previous crash (not with external
+    # workers - they may share this disk and still be using their files)
+    if not Config.EXTERNAL_WORKERS:
+        removed = spool.cleanup_orphans()
+        print(f"🧹 Removed {removed} orphaned download(s)")
+    
     # Start Flask server in a separate thread
     print("🌐 Starting health check server...")
     flask_thread = Thread(target=run_flask, daemon=True)
@@ -147,7 +223,7 @@ if __name__ == "__main__":
     
     # Run the bot
     try:
-        app.run()
+        app.run(run_bot())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
@@ -6,9 +6,11 @@ import logging
 from pyrogram import Client, filters, enums
 from pyrogram.errors.exceptions.bad_request_400 import MessageTooLong
 from pyrogram.errors import FloodWait
+from bson import ObjectId
 from database import db
 from config import Config
 from utils import users_broadcast, groups_broadcast, temp, get_readable_time, clear_junk, junk_group
+from ratelimit import AdaptiveRateLimiter
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 ADMINS = Config.ADMINS
@@ -56,48 +58,107 @@ async def handle_pin_choice(bot, query):
     del pending_broadcasts[user_id]
     await query.answer()
 
-async def execute_user_broadcast(bot, chat_id, user_id, b_msg, is_pin):
-    """Execute user broadcast"""
-    users = [user async for user in await db.get_all_users()]
-    total_users = len(users)
-    status_msg = await bot.send_message(chat_id, "📤 <b>Broadcasting your message...</b>")
-    success = blocked = deleted = failed = 0
+async def execute_user_broadcast(bot, chat_id, user_id, b_msg, is_pin, run=None):
+    """Execute user broadcast - user ids are streamed from a projected
+    cursor, so the first message goes out before the whole list is read.
+    
+    Progress is checkpointed to a broadcast run after every batch; pass that
+    run back in (claimed with db.claim_broadcast) to carry on after the last
+    user it reached."""
+    total_users = await db.total_users_count()
+    if run is None:
+        run_id = await db.create_broadcast({
+            'chat_id': b_msg.chat.id,
+            'message_id': b_msg.id,
+            'pin': is_pin,
+            'admin_chat_id': chat_id
+        })
+        last_id = None
+        counters = {'done': 0, 'success': 0, 'blocked': 0, 'deleted': 0, 'failed': 0}
+        status_msg = await bot.send_message(chat_id, "📤 <b>Broadcasting your message...</b>")
+    else:
+        run_id, last_id, counters = run['_id'], run['last_id'], run['counters']
+        status_msg = await bot.send_message(chat_id, f"📤 <b>Resuming broadcast after {counters['done']} users...</b>")
+    success, blocked, deleted, failed = counters['success'], counters['blocked'], counters['deleted'], counters['failed']
     start_time = time.time()
     cancelled = False
+    
+    # Every send waits for a token, so the bot runs at a steady rate just
+    # under Telegram's limit instead of bursting into FloodWaits
+    limiter = AdaptiveRateLimiter(Config.BROADCAST_RATE, Config.BROADCAST_MIN_RATE, Config.BROADCAST_RATE_STEP_AFTER)
 
-    async def send(user):
+    # Blocked / deleted users, tombstoned in bulk so later broadcasts skip them
+    dead = {}
+
+    async def prune():
+        batch = dict(dead)
+        dead.clear()
         try:
-            _, result = await users_broadcast(int(user["id"]), b_msg, is_pin)
-            return result
-        except FloodWait as e:
-            logging.warning(f"FloodWait: {e.value} seconds")
-            await asyncio.sleep(e.value)
-            return "Error"
+            await db.prune_users(batch)
         except Exception as e:
-            logging.exception(f"Error sending broadcast to {user['id']}")
-            return "Error"
+            logging.error(f"Failed to prune {len(batch)} user(s): {e}")
+
+    async def send(user):
+        while True:
+            await limiter.acquire()
+            try:
+                _, result = await users_broadcast(int(user["id"]), b_msg, is_pin)
+                limiter.on_success()
+                return result
+            except FloodWait as e:
+                # Pause everyone, slow down, then retry this user
+                limiter.on_flood(e.value)
+            except Exception as e:
+                logging.exception(f"Error sending broadcast to {user['id']}")
+                return "Error"
 
+    async def batches(size=100):
+        batch = []
+        async for user in db.iter_user_ids(after=last_id):
+            batch.append(user)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    done = start_done = counters['done']
+    last_report = (time.time(), done)
     async with lock:
-        for i in range(0, total_users, 100):
+        async for batch in batches():
             if temp.B_USERS_CANCEL:
                 temp.B_USERS_CANCEL = False
                 cancelled = True
                 break
-            batch = users[i:i + 100]
             results = await asyncio.gather(*[send(user) for user in batch])
 
-            for res in results:
+            for user, res in zip(batch, results):
                 if res == "Success":
                     success += 1
                 elif res == "Blocked":
                     blocked += 1
+                    dead[user["id"]] = res
                 elif res == "Deleted":
                     deleted += 1
+                    dead[user["id"]] = res
                 elif res == "Error":
                     failed += 1
+            if len(dead) >= Config.BROADCAST_PRUNE_BATCH:
+                await prune()
 
-            done = i + len(batch)
-            elapsed = get_readable_time(time.time() - start_time)
+            done += len(batch)
+            last_id = batch[-1]["_id"]
+            try:
+                await db.checkpoint_broadcast(run_id, last_id, {
+                    'done': done, 'success': success, 'blocked': blocked,
+                    'deleted': deleted, 'failed': failed
+                })
+            except Exception as e:
+                logging.error(f"Failed to checkpoint broadcast {run_id}: {e}")
+            now = time.time()
+            elapsed = get_readable_time(now - start_time)
+            speed = (done - last_report[1]) / max(now - last_report[0], 0.001)
+            last_report = (now, done)
             
             try:
                 await status_msg.edit(
@@ -107,6 +168,7 @@ async def execute_user_broadcast(bot, chat_id, user_id, b_msg, is_pin):
                     f"📬 Success: <code>{success}</code>\n"
                     f"⛔ Blocked: <code>{blocked}</code>\n"
                     f"🗑️ Deleted: <code>{deleted}</code>\n"
+                    f"🚀 Speed: <code>{speed:.1f} msg/s</code> (limit {limiter.rate:.0f}/s)\n"
                     f"⏱️ Time: {elapsed}",
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("❌ CANCEL", callback_data="broadcast_cancel#users")]
@@ -116,9 +178,9 @@ async def execute_user_broadcast(bot, chat_id, user_id, b_msg, is_pin):
                 await asyncio.sleep(e.value)
             except Exception:
                 pass
-            
-            await asyncio.sleep(0.1)
     
+    await prune()
+    await db.set_broadcast_state(run_id, 'cancelled' if cancelled else 'completed')
     elapsed = get_readable_time(time.time() - start_time)
     final_status = (
         f"{'❌ <b>Broadcast Cancelled.</b>' if cancelled else '✅ <b>Broadcast Completed.</b>'}\n\n"
@@ -127,10 +189,67 @@ async def execute_user_broadcast(bot, chat_id, user_id, b_msg, is_pin):
         f"📬 Success: <code>{success}</code>\n"
         f"⛔ Blocked: <code>{blocked}</code>\n"
         f"🗑️ Deleted: <code>{deleted}</code>\n"
-        f"❌ Failed: <code>{failed}</code>"
+        f"❌ Failed: <code>{failed}</code>\n"
+        f"🚀 Average: <code>{(done - start_done) / max(time.time() - start_time, 0.001):.1f} msg/s</code>, FloodWaits: <code>{limiter.floods}</code>"
     )
     await status_msg.edit(final_status)
 
+async def offer_broadcast_resume(bot):
+    """Called at startup: ask the admin who started each interrupted
+    broadcast whether to resume it from its checkpoint"""
+    try:
+        runs = await db.interrupt_broadcasts()
+    except Exception as e:
+        logging.error(f"Failed to load interrupted broadcasts: {e}")
+        return
+    
+    for run in runs:
+        counters = run['counters']
+        try:
+            await bot.send_message(
+                run['admin_chat_id'],
+                f"⚠️ <b>A broadcast was interrupted.</b>\n\n"
+                f"🗓️ Started: <code>{run['created_at']:%Y-%m-%d %H:%M}</code>\n"
+                f"✅ Done: <code>{counters['done']}</code>\n"
+                f"📬 Success: <code>{counters['success']}</code>\n\n"
+                f"Resume it from where it stopped?",
+                reply_markup=InlineKeyboardMarkup([
+                    [
+                        InlineKeyboardButton("▶️ Resume", callback_data=f"broadcast_resume#{run['_id']}"),
+                        InlineKeyboardButton("🗑️ Discard", callback_data=f"broadcast_discard#{run['_id']}")
+                    ]
+                ])
+            )
+        except Exception as e:
+            logging.error(f"Failed to offer broadcast resume to {run['admin_chat_id']}: {e}")
+
+@Client.on_callback_query(filters.regex(r'^broadcast_(resume|discard)#') & filters.user(ADMINS))
+async def handle_broadcast_resume(bot, query):
+    """Resume or discard an interrupted broadcast"""
+    action, run_id = query.data.split("#", 1)
+    if action == "broadcast_resume" and lock.locked():
+        return await query.answer("⚠️ Another broadcast is in progress. Please wait...", show_alert=True)
+    
+    run = await db.claim_broadcast(ObjectId(run_id))
+    if not run:
+        return await query.answer("❌ This broadcast is no longer pending.", show_alert=True)
+    
+    if action == "broadcast_discard":
+        await db.set_broadcast_state(run['_id'], 'cancelled')
+        await query.message.edit("🗑️ Interrupted broadcast discarded.")
+        return
+    
+    # The source message is copied again, so it has to still exist
+    b_msg = await bot.get_messages(run['chat_id'], run['message_id'])
+    if not b_msg or b_msg.empty:
+        await db.set_broadcast_state(run['_id'], 'cancelled')
+        await query.message.edit("❌ The broadcast message was deleted, it can't be resumed.")
+        return
+    
+    await query.message.delete()
+    await query.answer()
+    await execute_user_broadcast(bot, query.message.chat.id, query.from_user.id, b_msg, run['pin'], run=run)
+
 async def execute_group_broadcast(bot, chat_id, user_id, b_msg, is_pin):
     """Execute group broadcast"""
     chats = await db.get_all_chats()
@@ -249,7 +368,8 @@ async def broadcast_group(bot, message):
 
 @Client.on_message(filters.command("clear_junk") & filters.user(ADMINS))
 async def remove_junkuser__db(bot, message):
-    users = await db.get_all_users()
+    # Same active users total_users_count() counts - tombstoned ones are skipped
+    users = db.iter_user_ids()
     b_msg = message 
     sts = await message.reply_text('ɪɴ ᴘʀᴏɢʀᴇss.... ᴘʟᴇᴀsᴇ ᴡᴀɪᴛ')   
     start_time = time.time()
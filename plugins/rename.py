@@ -1,27 +1,32 @@
 import os
-import time
-import datetime
 import asyncio
 from pyrogram import Client, filters
 from pyrogram.types import ForceReply
 from config import Config
 from database import db
 from script import script
-from utils import get_size
+from utils import get_size, render_name_template
+from transfer import stream_rename, relay_rename, parallel_download, upload_file, upload_buffer, send_uploaded
+from scheduler import scheduler
+from spool import spool, shared_downloads, memory_pool
+from progress import reporter
+from probe import probe_file, probe_buffer
+from thumbcache import thumb_cache
+from pool import client_pool
+from jobs import WORKER_ID
 
 # Store file info temporarily
 user_files = {}
 
+# Files collected for a batch rename, per user
+batch_files = {}
+
+BATCH_PROMPT = "Send me the name template for this batch"
+
 async def get_file_limit(user_id):
     """Get file size limit for user (2GB free, 4GB premium)"""
-    user_data = await db.get_user(user_id)
-    
-    if user_data and user_data.get("expiry_time"):
-        expiry = user_data.get("expiry_time")
-        if expiry > datetime.datetime.now():
-            return Config.PREMIUM_USER_LIMIT  # 4GB for premium
-    
-    return Config.FREE_USER_LIMIT  # 2GB for free users
+    context = await db.get_rename_context(user_id)
+    return context['limit']
 
 @Client.on_message((filters.document | filters.video | filters.audio) & filters.private)
 async def handle_file(client, message):
@@ -39,19 +44,36 @@ async def handle_file(client, message):
     
     # Check file size limit
     file_size = file.file_size
-    file_limit = await get_file_limit(user_id)
+    context = await db.get_rename_context(user_id)
     
-    if file_size > file_limit:
+    if file_size > context['limit']:
         await message.reply(script.FILE_SIZE_ERROR)
         return
     
-    # Store file info
-    user_files[user_id] = {
+    file_data = {
         'message': message,
         'file': file,
-        'file_size': file_size
+        'file_size': file_size,
+        'premium': context['premium']
     }
     
+    # Anything that isn't part of it closes an album still waiting for its template
+    batch = batch_files.get(user_id)
+    if batch and batch['album'] and batch['group'] != message.media_group_id:
+        del batch_files[user_id]
+        await message.reply(
+            f"<b>🗑️ The previous album ({len(batch['files'])} files) was closed without a template.</b>",
+            quote=True
+        )
+    
+    # Batch mode (or an album) - collect the file, name them all with one template
+    if user_id in batch_files or message.media_group_id:
+        await add_to_batch(message, file_data)
+        return
+    
+    # Store file info
+    user_files[user_id] = file_data
+    
     # Ask for new filename - NOW AS A REPLY TO THE USER'S FILE
     await message.reply(
         f"<b>📝 Current File Name:</b> <code>{file.file_name}</code>\n\n"
@@ -61,10 +83,118 @@ async def handle_file(client, message):
         quote=True  # This makes it a reply to the file message
     )
 
+async def add_to_batch(message, file_data):
+    """Collect a file for the user's batch rename"""
+    user_id = message.from_user.id
+    batch = batch_files.get(user_id)
+    
+    # An album sent outside /batch starts its own batch, for that album only
+    if batch is None:
+        batch = batch_files[user_id] = {
+            'files': [], 'title': None, 'album': True, 'group': message.media_group_id, 'prompts': set()
+        }
+    
+    batch['files'].append(file_data)
+    
+    if batch['album']:
+        # Ask for the template once per album
+        if len(batch['files']) == 1:
+            prompt = await message.reply(
+                f"<b>📦 {BATCH_PROMPT}</b>\n\n"
+                f"<b>Placeholders:</b> <code>{{title}}</code> <code>{{name}}</code> "
+                f"<code>{{index}}</code> <code>{{ext}}</code>\n"
+                f"<b>Example:</b> <code>{{title}} S01E{{index:02d}}.{{ext}}</code>",
+                reply_markup=ForceReply(True),
+                quote=True
+            )
+            batch['prompts'].add(prompt.id)
+    elif not message.media_group_id or len(batch['files']) == 1:
+        await message.reply(
+            f"<b>📦 Added to batch ({len(batch['files'])} files)</b>\n\n"
+            f"Send more files or /done when finished.",
+            quote=True
+        )
+
+@Client.on_message(filters.command("batch") & filters.private)
+async def start_batch(client, message):
+    user_id = message.from_user.id
+    title = " ".join(message.command[1:]) or None
+    batch_files[user_id] = {'files': [], 'title': title, 'album': False, 'group': None, 'prompts': set()}
+    user_files.pop(user_id, None)
+    
+    await message.reply(
+        "<b>📦 Batch mode on</b>\n\n"
+        "Send all the files you want to rename, then /done.\n"
+        "Use /cancelbatch to stop.\n\n"
+        "<b>Tip:</b> <code>/batch My Show</code> sets <code>{title}</code> for the template."
+    )
+
+@Client.on_message(filters.command("cancelbatch") & filters.private)
+async def cancel_batch(client, message):
+    if batch_files.pop(message.from_user.id, None) is None:
+        return await message.reply("<b>❌ You have no batch in progress.</b>")
+    await message.reply("<b>🗑️ Batch cancelled.</b>")
+
+@Client.on_message(filters.command("done") & filters.private)
+async def finish_batch(client, message):
+    batch = batch_files.get(message.from_user.id)
+    if not batch or not batch['files']:
+        return await message.reply("<b>❌ Send some files after /batch first.</b>")
+    
+    prompt = await message.reply(
+        f"<b>📦 {BATCH_PROMPT} ({len(batch['files'])} files)</b>\n\n"
+        f"<b>Placeholders:</b> <code>{{title}}</code> <code>{{name}}</code> "
+        f"<code>{{index}}</code> <code>{{ext}}</code>\n"
+        f"<b>Example:</b> <code>{{title}} S01E{{index:02d}}.{{ext}}</code>",
+        reply_markup=ForceReply(True)
+    )
+    batch['prompts'].add(prompt.id)
+
+async def run_batch(client, message, batch):
+    """Rename every file of a batch with one template, pipelining the transfers"""
+    user_id = message.from_user.id
+    template = message.text
+    files = sorted(batch['files'], key=lambda data: data['message'].id)
+    
+    # Render every name first so a bad template fails before anything starts
+    names = []
+    try:
+        for index, file_data in enumerate(files, start=1):
+            original = file_data['file'].file_name or file_data['file'].file_unique_id
+            stem, ext = os.path.splitext(original)
+            names.append(render_name_template(
+                template,
+                title=batch['title'] or stem,
+                name=stem,
+                index=index,
+                ext=ext.lstrip(".")
+            ))
+    except (ValueError, KeyError, IndexError) as e:
+        return await message.reply(f"<b>❌ Invalid template:</b> {e}\n\nReply again with a fixed template.")
+    
+    del batch_files[user_id]
+    context = await db.get_rename_context(user_id)
+    upload_as_doc = context['upload_as_doc']
+    thumb_id = context['thumb_id']
+    
+    await message.reply(f"<b>📦 Renaming {len(files)} files...</b>")
+    for file_data, new_name in zip(files, names):
+        await queue_rename(client, file_data['message'], file_data, new_name, upload_as_doc, thumb_id, pipeline=True)
+
 @Client.on_message(filters.text & filters.private & filters.reply)
 async def rename_file(client, message):
     user_id = message.from_user.id
     
+    # Template for a batch rename - only for the prompt of the current batch
+    batch = batch_files.get(user_id)
+    prompt = message.reply_to_message.text if message.reply_to_message else None
+    if BATCH_PROMPT in (prompt or ""):
+        if batch and batch['files'] and message.reply_to_message.id in batch['prompts']:
+            await run_batch(client, message, batch)
+        else:
+            await message.reply("<b>❌ That batch is no longer active.</b>")
+        return
+    
     # Check if this is a filename reply
     if user_id not in user_files:
         return
@@ -72,240 +202,457 @@ async def rename_file(client, message):
     if not message.reply_to_message or not message.reply_to_message.reply_markup:
         return
     
-    file_data = user_files[user_id]
-    original_message = file_data['message']
-    file = file_data['file']
+    # Free the slot so the user can queue another file right away
+    file_data = user_files.pop(user_id)
     new_name = message.text
     
-    # Get upload mode
-    upload_as_doc = await db.get_upload_mode(user_id)
+    # Upload mode and thumbnail file_id in one query
+    context = await db.get_rename_context(user_id)
+    upload_as_doc = context['upload_as_doc']
+    thumb_id = context['thumb_id']
     
-    # Get thumbnail file_id (FIXED - use file_id directly, no download needed)
-    thumb_id = await db.get_thumbnail(user_id)
+    await queue_rename(client, message, file_data, new_name, upload_as_doc, thumb_id)
+
+async def queue_rename(client, message, file_data, new_name, upload_as_doc, thumb_id, pipeline=False, job_id=None,
+                       status_msg=None):
+    """Hand one rename to the scheduler (or answer it from the cache)"""
+    user_id = message.from_user.id
+    
+    # Same file, name, thumbnail and mode renamed before - resend the result instantly
+    if Config.RENAME_CACHE and await send_cached_rename(client, message, file_data, new_name, upload_as_doc, thumb_id):
+        if job_id:
+            await db.set_job_state(job_id, 'done')
+        # A claimed or recovered job still shows "Queued" from the front-end
+        if status_msg:
+            try:
+                await status_msg.delete()
+            except Exception as e:
+                print(f"Failed to delete status message: {e}")
+        return
     
     # Start processing
-    status_msg = await message.reply("⏳ <b>Processing your file...</b>")
+    if status_msg is None:
+        status_msg = await message.reply("⏳ <b>Processing your file...</b>")
     
-    try:
-        # Download file with progress (optimized for high speed)
-        start_time = time.time()
+    # Persist the job so a restart or crash can pick it up again
+    if job_id is None:
+        external = Config.EXTERNAL_WORKERS
+        job_id = await db.create_job(
+            {
+                'user_id': user_id,
+                'chat_id': message.chat.id,
+                'message_id': message.id,
+                'source_chat_id': file_data['message'].chat.id,
+                'source_message_id': file_data['message'].id,
+                'file_unique_id': file_data['file'].file_unique_id,
+                'file_size': file_data['file_size'],
+                'new_name': new_name,
+                'upload_as_doc': upload_as_doc,
+                'thumb_id': thumb_id,
+                'premium': file_data['premium'],
+                'pipeline': pipeline,
+                'status_msg_id': status_msg.id
+            },
+            None if external else WORKER_ID,
+            Config.JOB_LEASE
+        )
         
-        # Use custom downloader for better speed
-        file_path = await fast_download(
-            client=client,
-            message=original_message,
-            status_msg=status_msg,
-            start_time=start_time
+        if external:
+            # A worker process claims it from the shared queue and reports
+            # progress by editing this same status message
+            await status_msg.edit("⏳ <b>Queued, waiting for a free worker...</b>")
+            return
+    
+    async def on_queued(position):
+        await status_msg.edit(
+            f"⏳ <b>Waiting in queue...</b>\n\n"
+            f"📋 <b>Position :</b> {position}\n"
+            f"📊 <b>File Size :</b> {get_size(file_data['file_size'])}"
         )
+    
+    # Counted until the job ends, so concurrent jobs for this file share one download
+    file_unique_id = file_data['file'].file_unique_id
+    shared_downloads.want(file_unique_id)
+    
+    # Bounded global concurrency, one job at a time per user, premium lane first
+    task = scheduler.submit(
+        user_id,
+        file_data['file_size'],
+        lambda: process_rename(client, message, file_data, new_name, upload_as_doc, thumb_id, status_msg, job_id),
+        on_queued=on_queued,
+        premium=file_data['premium'],
+        pipeline=pipeline
+    )
+    task.add_done_callback(lambda _: shared_downloads.unwant(file_unique_id))
+
+async def send_cached_rename(client, message, file_data, new_name, upload_as_doc, thumb_id):
+    """Answer from the rename cache, returns False on a miss"""
+    file_unique_id = file_data['file'].file_unique_id
+    file_id = await db.get_cached_rename(file_unique_id, new_name, thumb_id, upload_as_doc)
+    if not file_id:
+        return False
+    
+    try:
+        await client.send_cached_media(
+            chat_id=message.chat.id,
+            file_id=file_id,
+            caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
+            reply_to_message_id=message.id
+        )
+        return True
+    except Exception as e:
+        # Stale file reference - forget it and do a real rename
+        print(f"Rename cache send failed: {e}")
+        await db.invalidate_cached_rename(file_unique_id, new_name, thumb_id, upload_as_doc)
+        return False
+
+async def process_rename(client, message, file_data, new_name, upload_as_doc, thumb_id, status_msg, job_id):
+    """Run one rename job once the scheduler gives it a slot"""
+    original_message = file_data['message']
+    file_unique_id = file_data['file'].file_unique_id
+    
+    # Free jobs get a smaller slice of the transfer engine while premium jobs are active
+    share = scheduler.transfer_share(file_data['premium'])
+    
+    try:
+        await db.set_job_state(job_id, 'downloading')
         
-        # Rename file
-        new_path = os.path.join(os.path.dirname(file_path), new_name)
-        os.rename(file_path, new_path)
+        # Pre-resized local copy of the thumbnail, the file_id is only a fallback
+        thumb = await thumb_cache.get(client, thumb_id) if thumb_id else None
+        thumb = thumb or thumb_id
         
-        # Upload file with progress (optimized for high speed)
-        await status_msg.edit("📤 <b>Uploading renamed file...</b>")
-        start_time = time.time()
+        # Small files are renamed entirely in memory, as long as the global
+        # memory cap allows - otherwise they take the same path as big ones
+        file_size = file_data['file_size']
+        if file_size <= Config.MEMORY_RENAME_MAX and memory_pool.try_reserve(file_size):
+            try:
+                sent = await memory_upload(
+                    client=client,
+                    message=message,
+                    original_message=original_message,
+                    upload_as_doc=upload_as_doc,
+                    thumb=thumb,
+                    new_name=new_name,
+                    status_msg=status_msg,
+                    share=share
+                )
+            finally:
+                memory_pool.release(file_size)
+            await finish_rename(file_data, new_name, upload_as_doc, thumb_id, sent, status_msg, job_id)
+            return
         
-        if upload_as_doc:
-            await fast_upload_document(
-                client=client,
-                message=message,
-                file_path=new_path,
-                thumb=thumb_id,  # Pass file_id directly
-                new_name=new_name,
-                status_msg=status_msg,
-                start_time=start_time
-            )
-        else:
-            await fast_upload_video(
+        # Stream straight from download to upload - no full file on disk -
+        # unless another job wants this file too and we can share one download
+        if Config.STREAM_RENAME and not shared_downloads.contended(file_unique_id):
+            # Carried by the least-loaded of the main bot and the helper bots
+            await db.set_job_state(job_id, 'uploading')
+            async with client_pool.lease(client, file_size) as transfer_client:
+                sent = await stream_upload(
+                    client=client,
+                    message=message,
+                    original_message=original_message,
+                    file_size=file_size,
+                    upload_as_doc=upload_as_doc,
+                    thumb=thumb,
+                    new_name=new_name,
+                    status_msg=status_msg,
+                    share=share,
+                    transfer_client=transfer_client
+                )
+            await finish_rename(file_data, new_name, upload_as_doc, thumb_id, sent, status_msg, job_id)
+            return
+        
+        # Download file with progress (optimized for high speed)
+        await status_msg.edit("📥 <b>Downloading file...</b>")
+        progress_callback = reporter.tracker(status_msg, "📥 Downloading...")
+        
+        # Use custom downloader for better speed - one download per source file,
+        # shared by every job that wants it at the same time
+        file_path = await shared_downloads.acquire(
+            file_unique_id,
+            lambda progress: fast_download(
                 client=client,
-                message=message,
-                file_path=new_path,
-                thumb=thumb_id,  # Pass file_id directly
-                new_name=new_name,
+                message=original_message,
                 status_msg=status_msg,
-                start_time=start_time
-            )
+                share=share,
+                progress=progress
+            ),
+            progress=progress_callback
+        )
         
-        await status_msg.delete()
+        # Batch jobs: let the next file start downloading while this one uploads
+        scheduler.handoff()
+        await db.set_job_state(job_id, 'uploading')
         
-        # Clean up
         try:
-            os.remove(new_path)
-        except:
-            pass
+            # Upload file with progress (optimized for high speed) - the new name is
+            # given to Telegram directly, the shared file on disk is never renamed
+            await status_msg.edit("📤 <b>Uploading renamed file...</b>")
+            
+            if upload_as_doc:
+                sent = await fast_upload_document(
+                    client=client,
+                    message=message,
+                    file_path=file_path,
+                    thumb=thumb,
+                    new_name=new_name,
+                    status_msg=status_msg,
+                    share=share
+                )
+            else:
+                sent = await fast_upload_video(
+                    client=client,
+                    message=message,
+                    file_path=file_path,
+                    thumb=thumb,
+                    new_name=new_name,
+                    status_msg=status_msg,
+                    share=share
+                )
+        finally:
+            # Clean up - the last job using the file frees the disk reservation
+            await shared_downloads.release(file_unique_id)
         
-        del user_files[user_id]
+        await finish_rename(file_data, new_name, upload_as_doc, thumb_id, sent, status_msg, job_id)
         
     except Exception as e:
+        await db.set_job_state(job_id, 'failed', error=str(e))
         await status_msg.edit(f"❌ <b>Error:</b> {str(e)}")
-        if user_id in user_files:
-            del user_files[user_id]
 
-async def fast_download(client, message, status_msg, start_time):
-    """Optimized download with high-speed settings"""
+async def finish_rename(file_data, new_name, upload_as_doc, thumb_id, sent, status_msg, job_id):
+    """Mark a job done, drop its status message and cache the result"""
+    await db.set_job_state(job_id, 'done')
+    await status_msg.delete()
+    await remember_rename(file_data, new_name, upload_as_doc, thumb_id, sent)
+
+async def recover_jobs(client):
+    """Requeue jobs interrupted by a restart or crash and tell their users.
+
+    Disk downloads continue from their chunk checkpoints, streamed ones
+    start over. Jobs that were already retried JOB_MAX_ATTEMPTS times, or
+    whose messages are gone, are marked failed.
+    """
+    for job in await db.claim_interrupted_jobs(WORKER_ID, Config.JOB_LEASE):
+        try:
+            await resume_job(client, job)
+        except Exception as e:
+            print(f"Job recovery failed for {job['_id']}: {e}")
+            await db.set_job_state(job['_id'], 'failed', error=str(e))
+
+async def claim_jobs(client):
+    """Worker mode: lease queued jobs from the shared queue while there is room"""
+    while len(scheduler.tasks) < Config.MAX_CONCURRENT_JOBS:
+        job = await db.claim_job(WORKER_ID, Config.JOB_LEASE)
+        if not job:
+            return
+        try:
+            await resume_job(client, job)
+        except Exception as e:
+            print(f"Failed to start job {job['_id']}: {e}")
+            await db.set_job_state(job['_id'], 'failed', error=str(e))
+
+async def resume_job(client, job):
+    """Put one claimed job on this process's scheduler"""
+    new_name = job['new_name']
+    
+    if job['attempts'] > Config.JOB_MAX_ATTEMPTS:
+        await db.set_job_state(job['_id'], 'failed', error="Too many interruptions")
+        await client.send_message(
+            job['chat_id'],
+            f"❌ <b>Renaming</b> <code>{new_name}</code> <b>was interrupted too many times. Please send the file again.</b>"
+        )
+        return
     
-    # Progress tracker
-    progress_data = {
-        'last_update': 0,
-        'start_time': start_time
+    original_message = await client.get_messages(job['source_chat_id'], job['source_message_id'])
+    message = await client.get_messages(job['chat_id'], job['message_id'])
+    file = None if original_message.empty else (
+        original_message.document or original_message.video or original_message.audio
+    )
+    if not file or message.empty:
+        await db.set_job_state(job['_id'], 'failed', error="Source message is gone")
+        await client.send_message(
+            job['chat_id'],
+            f"❌ <b>Renaming</b> <code>{new_name}</code> <b>was interrupted and the file is no longer available. Please send it again.</b>"
+        )
+        return
+    
+    file_data = {
+        'message': original_message,
+        'file': file,
+        'file_size': file.file_size,
+        'premium': job['premium']
     }
     
-    async def progress_callback(current, total):
-        await download_progress(current, total, status_msg, progress_data)
+    # Keep reporting in the job's original status message when it still exists
+    status_msg = None
+    if job.get('status_msg_id'):
+        status_msg = await client.get_messages(job['chat_id'], job['status_msg_id'])
+        status_msg = None if status_msg.empty else status_msg
+    
+    # First claim of a queued job is normal, later ones follow an interruption
+    if job['attempts'] > 1:
+        await message.reply(f"♻️ <b>Renaming</b> <code>{new_name}</code> <b>was interrupted by a restart and has been queued again.</b>")
+    await queue_rename(
+        client, message, file_data, new_name, job['upload_as_doc'], job['thumb_id'],
+        pipeline=job['pipeline'], job_id=job['_id'], status_msg=status_msg
+    )
+
+async def remember_rename(file_data, new_name, upload_as_doc, thumb_id, sent):
+    """Store the output file_id so the next identical rename is instant"""
+    if not Config.RENAME_CACHE or not sent:
+        return
+    
+    media = sent.document or sent.video or sent.audio
+    if not media:
+        return
     
-    # Create downloads directory
-    download_dir = "downloads/files"
-    os.makedirs(download_dir, exist_ok=True)
+    try:
+        await db.cache_rename(file_data['file'].file_unique_id, new_name, thumb_id, upload_as_doc, media.file_id)
+    except Exception as e:
+        print(f"Rename cache store failed: {e}")
+
+async def fast_download(client, message, status_msg, share=1.0, progress=None):
+    """Optimized download - parallel byte ranges over multiple media sessions"""
+    
+    # Shared downloads report to every waiting job instead
+    progress_callback = progress or reporter.tracker(status_msg, "📥 Downloading...")
     
-    # Download with optimized settings
-    file_path = await message.download(
-        file_name=download_dir + "/",
-        progress=progress_callback
+    async def on_wait():
+        await status_msg.edit("💾 <b>Waiting for free disk space...</b>")
+    
+    # Reserve and preallocate the whole file under DOWNLOAD_LOCATION first
+    # (keyed by file_unique_id so a retry finds the earlier partial download)
+    media = message.document or message.video or message.audio
+    file_path = await spool.reserve(
+        media.file_name or media.file_unique_id,
+        media.file_size,
+        on_wait=on_wait,
+        key=media.file_unique_id
     )
     
+    # Fetch missing byte ranges over several media sessions at once
+    try:
+        await parallel_download(
+            client,
+            message,
+            file_path,
+            media.file_size,
+            progress=progress_callback,
+            share=share
+        )
+    except BaseException:
+        # Keep the partial file and its .parts checkpoint for a retry
+        await spool.release(file_path, keep_partial=True)
+        raise
+    
     return file_path
 
-async def fast_upload_document(client, message, file_path, thumb, new_name, status_msg, start_time):
-    """Optimized document upload - thumb is file_id string"""
+async def memory_upload(client, message, original_message, upload_as_doc, thumb, new_name, status_msg, share=1.0):
+    """Small file rename - download into a BytesIO, rename it and upload from memory"""
     
-    progress_data = {
-        'last_update': 0,
-        'start_time': start_time
-    }
+    await status_msg.edit("📥 <b>Downloading file...</b>")
+    buffer = await client.download_media(
+        original_message,
+        in_memory=True,
+        progress=reporter.tracker(status_msg, "📥 Downloading...")
+    )
+    if buffer is None:
+        raise IOError("Download failed")
     
-    async def progress_callback(current, total):
-        await upload_progress(current, total, status_msg, progress_data)
+    # Batch jobs: let the next file start downloading while this one uploads
+    scheduler.handoff()
     
-    # Use thumb parameter directly (it's already a file_id string or None)
-    await message.reply_document(
-        document=file_path,
-        thumb=thumb,  # Pyrogram accepts file_id directly
+    # Renaming is just the buffer's name
+    buffer.name = new_name
+    
+    await status_msg.edit("📤 <b>Uploading renamed file...</b>")
+    file = await upload_buffer(client, buffer, progress=reporter.tracker(status_msg, "📤 Uploading..."), share=share)
+    video_info = None if upload_as_doc else await probe_buffer(buffer)
+    
+    return await send_uploaded(
+        client,
+        message,
+        file,
+        new_name,
+        as_video=not upload_as_doc,
+        thumb=thumb,
         caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
-        progress=progress_callback,
-        force_document=True
+        video_info=video_info
     )
 
-async def fast_upload_video(client, message, file_path, thumb, new_name, status_msg, start_time):
-    """Optimized video upload - thumb is file_id string"""
+async def stream_upload(client, message, original_message, file_size, upload_as_doc, thumb, new_name, status_msg, share=1.0,
+                        transfer_client=None):
+    """Streaming rename - upload starts while the download is still running.
+    Batch jobs hand off to the next file as soon as the download stream ends."""
     
-    progress_data = {
-        'last_update': 0,
-        'start_time': start_time
-    }
+    progress_callback = reporter.tracker(status_msg, "📤 Uploading...")
     
-    async def progress_callback(current, total):
-        await upload_progress(current, total, status_msg, progress_data)
-    
-    # Use thumb parameter directly (it's already a file_id string or None)
-    await message.reply_video(
-        video=file_path,
-        thumb=thumb,  # Pyrogram accepts file_id directly
+    await status_msg.edit("🔄 <b>Streaming renamed file...</b>")
+    if transfer_client and transfer_client is not client:
+        # A helper bot moves the bytes, the result still comes from this bot
+        return await relay_rename(
+            client,
+            transfer_client,
+            original_message,
+            file_size,
+            reply_to=message,
+            new_name=new_name,
+            as_video=not upload_as_doc,
+            thumb=thumb,
+            caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
+            progress=progress_callback,
+            share=share,
+            on_downloaded=scheduler.handoff
+        )
+    return await stream_rename(
+        client,
+        original_message,
+        file_size,
+        reply_to=message,
+        new_name=new_name,
+        as_video=not upload_as_doc,
+        thumb=thumb,
         caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
         progress=progress_callback,
-        supports_streaming=True
+        share=share,
+        on_downloaded=scheduler.handoff
     )
 
-async def download_progress(current, total, status_msg, progress_data):
-    """Optimized progress callback for downloads with custom UI"""
-    now = time.time()
+async def fast_upload_document(client, message, file_path, thumb, new_name, status_msg, share=1.0):
+    """Optimized document upload - thumb is a local path or file_id"""
     
-    # Update every 3 seconds to reduce API calls and improve speed
-    if now - progress_data['last_update'] < 3:
-        return
+    progress_callback = reporter.tracker(status_msg, "📤 Uploading...")
     
-    progress_data['last_update'] = now
-    
-    try:
-        # Calculate progress
-        percentage = (current / total) * 100
-        elapsed_time = now - progress_data['start_time']
-        speed = current / elapsed_time if elapsed_time > 0 else 0
-        
-        # Calculate ETA
-        if speed > 0:
-            eta_seconds = (total - current) / speed
-        else:
-            eta_seconds = 0
-        
-        # Format ETA
-        eta_min, eta_sec = divmod(int(eta_seconds), 60)
-        eta_hr, eta_min = divmod(eta_min, 60)
-        
-        if eta_hr > 0:
-            eta_str = f"{eta_hr} hr, {eta_min} min"
-        elif eta_min > 0:
-            eta_str = f"{eta_min} min, {eta_sec} sec"
-        else:
-            eta_str = f"{eta_sec} sec"
-        
-        # Create progress bar (20 blocks)
-        filled_blocks = int(percentage / 5)  # 20 blocks total (100/5)
-        progress_bar = "■" * filled_blocks + "□" * (20 - filled_blocks)
-        
-        # Format message
-        progress_text = (
-            f"<b>📥 Downloading...</b>\n\n"
-            f"<code>{progress_bar}</code>\n\n"
-            f"📁 <b>Size :</b> {get_size(current)} / {get_size(total)}\n"
-            f"⏳️ <b>Done :</b> {percentage:.1f}%\n"
-            f"🚀 <b>Speed :</b> {get_size(speed)}/s\n"
-            f"⏰️ <b>ETA :</b> {eta_str}"
-        )
-        
-        await status_msg.edit(progress_text)
-        
-    except Exception as e:
-        pass
+    # Several parts in flight over multiple upload sessions, failed parts retried alone
+    file = await upload_file(client, file_path, new_name, progress=progress_callback, share=share)
+    return await send_uploaded(
+        client,
+        message,
+        file,
+        new_name,
+        as_video=False,
+        thumb=thumb,  # a file_id fallback is fetched into memory by send_uploaded
+        caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>"
+    )
 
-async def upload_progress(current, total, status_msg, progress_data):
-    """Optimized progress callback for uploads with custom UI"""
-    now = time.time()
+async def fast_upload_video(client, message, file_path, thumb, new_name, status_msg, share=1.0):
+    """Optimized video upload - thumb is a local path or file_id"""
     
-    # Update every 3 seconds to reduce API calls and improve speed
-    if now - progress_data['last_update'] < 3:
-        return
+    progress_callback = reporter.tracker(status_msg, "📤 Uploading...")
     
-    progress_data['last_update'] = now
+    # Several parts in flight over multiple upload sessions, failed parts retried alone
+    file = await upload_file(client, file_path, new_name, progress=progress_callback, share=share)
     
-    try:
-        # Calculate progress
-        percentage = (current / total) * 100
-        elapsed_time = now - progress_data['start_time']
-        speed = current / elapsed_time if elapsed_time > 0 else 0
-        
-        # Calculate ETA
-        if speed > 0:
-            eta_seconds = (total - current) / speed
-        else:
-            eta_seconds = 0
-        
-        # Format ETA
-        eta_min, eta_sec = divmod(int(eta_seconds), 60)
-        eta_hr, eta_min = divmod(eta_min, 60)
-        
-        if eta_hr > 0:
-            eta_str = f"{eta_hr} hr, {eta_min} min"
-        elif eta_min > 0:
-            eta_str = f"{eta_min} min, {eta_sec} sec"
-        else:
-            eta_str = f"{eta_sec} sec"
-        
-        # Create progress bar (20 blocks)
-        filled_blocks = int(percentage / 5)  # 20 blocks total (100/5)
-        progress_bar = "■" * filled_blocks + "□" * (20 - filled_blocks)
-        
-        # Format message
-        progress_text = (
-            f"<b>📤 Uploading...</b>\n\n"
-            f"<code>{progress_bar}</code>\n\n"
-            f"📁 <b>Size :</b> {get_size(current)} / {get_size(total)}\n"
-            f"⏳️ <b>Done :</b> {percentage:.1f}%\n"
-            f"🚀 <b>Speed :</b> {get_size(speed)}/s\n"
-            f"⏰️ <b>ETA :</b> {eta_str}"
-        )
-        
-        await status_msg.edit(progress_text)
-        
-    except Exception as e:
-        pass
+    # Duration and resolution straight from the container headers (no ffmpeg)
+    video_info = await probe_file(file_path)
+    
+    return await send_uploaded(
+        client,
+        message,
+        file,
+        new_name,
+        as_video=True,
+        thumb=thumb,  # a file_id fallback is fetched into memory by send_uploaded
+        caption=f"<b>✅ File renamed successfully!</b>\n\n<b>New Name:</b> <code>{new_name}</code>",
+        video_info=video_info
+    )
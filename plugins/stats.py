@@ -0,0 +1,17 @@
+from pyrogram import Client, filters
+from database import db
+from config import Config
+
+ADMINS = Config.ADMINS
+
+@Client.on_message(filters.command("cachestats") & filters.user(ADMINS))
+async def cache_stats(bot, message):
+    """Show the user profile cache hit rate"""
+    stats = db.user_cache_stats()
+    await message.reply(
+        f"<b>📦 User Cache</b>\n\n"
+        f"<b>Cached Users:</b> {stats['size']} / {Config.USER_CACHE_SIZE}\n"
+        f"<b>Hits:</b> {stats['hits']}\n"
+        f"<b>Misses:</b> {stats['misses']}\n"
+        f"<b>Hit Rate:</b> {stats['hit_rate'] * 100:.1f}%"
+    )
@@ -1,6 +1,7 @@
 from pyrogram import Client, filters
 from pyrogram.types import ForceReply, InlineKeyboardButton, InlineKeyboardMarkup
 from database import db
+from thumbcache import thumb_cache
 from script import script
 
 @Client.on_message(filters.command("addthumb") & filters.private)
@@ -18,6 +19,10 @@ async def save_thumbnail(client, message):
             file_id = message.photo.file_id
             
             await db.set_thumbnail(user_id, file_id)
+            
+            # Download and resize it once now, every rename reuses the local copy
+            await thumb_cache.get(client, file_id)
+            
             await message.reply(script.THUMB_ADDED)
             return
 
@@ -43,6 +48,7 @@ async def delete_thumbnail_cmd(client, message):
     
     if thumb:
         await db.delete_thumbnail(user_id)
+        thumb_cache.discard(thumb)
         await message.reply(script.THUMB_DELETED)
     else:
         await message.reply(script.NO_THUMB)
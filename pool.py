@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from pyrogram import Client
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def create_helpers():
+    """Plugin-free transfer-only Clients for HELPER_TOKENS"""
+    if not Config.HELPER_TOKENS:
+        return []
+    if not Config.BIN_CHANNEL:
+        logger.warning("HELPER_TOKENS are set but BIN_CHANNEL is not - helper bots disabled")
+        return []
+
+    return [
+        Client(
+            f"helper_{index}",
+            api_id=Config.API_ID,
+            api_hash=Config.API_HASH,
+            bot_token=token,
+            in_memory=True,
+            no_updates=True,
+            workdir=Config.WORKDIR,
+            sleep_threshold=Config.SLEEP_THRESHOLD,
+            max_concurrent_transmissions=Config.MAX_CONCURRENT_TRANSMISSIONS
+        )
+        for index, token in enumerate(Config.HELPER_TOKENS, start=1)
+    ]
+
+
+class ClientPool:
+    """Spreads rename transfers over the main bot and optional helper bots.
+
+    Every transfer leases the least-loaded client (fewest running transfers,
+    then fewest bytes in flight; helpers win ties so the main bot keeps
+    headroom for user-facing messages). Helpers are started on their first
+    lease, and one that fails to start is left out from then on.
+    """
+
+    def __init__(self, helpers):
+        self.helpers = list(helpers)
+        self.load = {}
+        self.started = set()
+        self.failed = set()
+        self.lock = asyncio.Lock()
+
+    def _candidates(self, main):
+        return [main] + [helper for helper in self.helpers if helper not in self.failed]
+
+    def least_loaded(self, main):
+        return min(
+            self._candidates(main),
+            key=lambda client: (*self.load.get(client, (0, 0)), client is main)
+        )
+
+    def _add(self, client, jobs, size):
+        count, inflight = self.load.get(client, (0, 0))
+        if count + jobs:
+            self.load[client] = (count + jobs, inflight + size)
+        else:
+            self.load.pop(client, None)
+
+    async def _ensure_started(self, client):
+        async with self.lock:
+            if client in self.started:
+                return True
+            try:
+                await client.start()
+            except Exception as e:
+                logger.error(f"Helper {client.name} failed to start: {e}")
+                self.failed.add(client)
+                return False
+            self.started.add(client)
+            logger.info(f"✅ Helper {client.name} started")
+            return True
+
+    @asynccontextmanager
+    async def lease(self, main, size):
+        """Yield the client that should carry a transfer of size bytes"""
+        while True:
+            client = self.least_loaded(main)
+            self._add(client, 1, size)
+            if client is main or await self._ensure_started(client):
+                break
+            self._add(client, -1, -size)
+
+        try:
+            yield client
+        finally:
+            self._add(client, -1, -size)
+
+    async def stop(self):
+        for client in list(self.started):
+            try:
+                await client.stop()
+            except Exception as e:
+                logger.warning(f"Failed to stop helper {client.name}: {e}")
+        self.started.clear()
+
+
+client_pool = ClientPool(create_helpers())
@@ -0,0 +1,344 @@
+import os
+import struct
+import asyncio
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Matroska / WebM element IDs (marker bits kept, as they appear in the file)
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CLUSTER = 0x1F43B675
+
+
+class ProbeError(Exception):
+    """Raised when a container header is truncated or malformed"""
+
+
+class FileReader:
+    """Random access reads from a local file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    async def read(self, offset, size):
+        def pread():
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return f.read(size)
+        return await asyncio.get_running_loop().run_in_executor(None, pread)
+
+
+class BytesReader:
+    """Random access reads from an in-memory file (BytesIO)"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.size = buffer.getbuffer().nbytes
+
+    async def read(self, offset, size):
+        with self.buffer.getbuffer() as view:
+            return bytes(view[offset:offset + size])
+
+
+class MessageReader:
+    """Random access reads from a Telegram file, fetched in CHUNK_SIZE chunks.
+
+    Only the chunks a read touches are downloaded, and they are kept for
+    later reads, so probing costs a few chunks instead of the whole file.
+    """
+
+    def __init__(self, client, message, size):
+        self.client = client
+        self.message = message
+        self.size = size
+        self.chunks = {}
+
+    async def _chunk(self, index):
+        if index not in self.chunks:
+            data = b""
+            async for chunk in self.client.stream_media(self.message, offset=index, limit=1):
+                data += chunk
+            self.chunks[index] = data
+        return self.chunks[index]
+
+    async def read(self, offset, size):
+        chunk_size = Config.CHUNK_SIZE
+        end = min(offset + size, self.size)
+        data = bytearray()
+        if end <= offset:
+            return b""
+        for index in range(offset // chunk_size, (end - 1) // chunk_size + 1):
+            chunk = await self._chunk(index)
+            start = index * chunk_size
+            data += chunk[max(offset - start, 0):end - start]
+        return bytes(data)
+
+
+async def _read_exact(reader, offset, size):
+    data = await reader.read(offset, size)
+    if len(data) < size:
+        raise ProbeError(f"Unexpected end of file at {offset}")
+    return data
+
+
+# MP4 / MOV
+
+def _iter_boxes(data, start=0, end=None):
+    """Yield (type, payload start, payload end) for the boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _find_box(data, kind, start, end):
+    for box, payload, box_end in _iter_boxes(data, start, end):
+        if box == kind:
+            return payload, box_end
+    return None
+
+
+def _parse_moov(moov):
+    info = {}
+    mvhd = _find_box(moov, b"mvhd", 0, len(moov))
+    if mvhd:
+        pos = mvhd[0]
+        if moov[pos] == 1:
+            timescale, duration = struct.unpack_from(">IQ", moov, pos + 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", moov, pos + 12)
+        if timescale:
+            info['duration'] = round(duration / timescale)
+
+    for box, start, end in _iter_boxes(moov):
+        if box != b"trak":
+            continue
+        mdia = _find_box(moov, b"mdia", start, end)
+        hdlr = mdia and _find_box(moov, b"hdlr", *mdia)
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+        tkhd = _find_box(moov, b"tkhd", start, end)
+        if not tkhd:
+            continue
+        # The 3x3 matrix and the 16.16 width/height close the tkhd box
+        a, b = struct.unpack_from(">ii", moov, tkhd[1] - 44)
+        width, height = struct.unpack_from(">II", moov, tkhd[1] - 8)
+        width, height = width >> 16, height >> 16
+        if a == 0 and b != 0:
+            # Rotated by 90 or 270 degrees
+            width, height = height, width
+        if width and height:
+            info['width'], info['height'] = width, height
+            break
+    return info
+
+
+async def _probe_mp4(reader):
+    """Walk the top level boxes, skipping mdat, and parse only moov"""
+    offset = 0
+    while offset + 8 <= reader.size:
+        header = await _read_exact(reader, offset, 16 if offset + 16 <= reader.size else 8)
+        size, kind = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = reader.size - offset
+        if size < header_size:
+            raise ProbeError(f"Bad box size at {offset}")
+
+        if kind == b"moov":
+            if size > Config.PROBE_MAX_HEADER:
+                raise ProbeError("moov box is too large to probe")
+            moov = await _read_exact(reader, offset + header_size, size - header_size)
+            return _parse_moov(moov)
+        offset += size
+    return {}
+
+
+# Matroska / WebM
+
+def _read_vint(data, pos, keep_marker=False):
+    """Read an EBML variable length integer, returning (value, length)"""
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise ProbeError(f"Bad EBML integer at {pos}")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = None  # Unknown size
+    return value, length
+
+
+def _iter_elements(data, start=0, end=None):
+    """Yield (id, payload start, payload end) for the elements in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos < end:
+        element_id, id_length = _read_vint(data, pos, keep_marker=True)
+        size, size_length = _read_vint(data, pos + id_length)
+        payload = pos + id_length + size_length
+        payload_end = end if size is None else payload + size
+        yield element_id, payload, min(payload_end, end)
+        pos = payload_end
+
+
+def _uint(data, start, end):
+    return int.from_bytes(data[start:end], "big")
+
+
+def _parse_info(data):
+    scale = 1000000
+    duration = None
+    for element_id, start, end in _iter_elements(data):
+        if element_id == TIMECODE_SCALE:
+            scale = _uint(data, start, end)
+        elif element_id == DURATION:
+            duration = struct.unpack(">f" if end - start == 4 else ">d", data[start:end])[0]
+    if duration is None:
+        return {}
+    return {'duration': round(duration * scale / 1e9)}
+
+
+def _parse_tracks(data):
+    for element_id, start, end in _iter_elements(data):
+        if element_id != TRACK_ENTRY:
+            continue
+        entry = dict((child, (s, e)) for child, s, e in _iter_elements(data, start, end))
+        if TRACK_TYPE not in entry or _uint(data, *entry[TRACK_TYPE]) != 1 or VIDEO not in entry:
+            continue
+        video = dict((child, (s, e)) for child, s, e in _iter_elements(data, *entry[VIDEO]))
+        if PIXEL_WIDTH in video and PIXEL_HEIGHT in video:
+            return {'width': _uint(data, *video[PIXEL_WIDTH]), 'height': _uint(data, *video[PIXEL_HEIGHT])}
+    return {}
+
+
+def _parse_seek_head(data):
+    """Positions of top level elements (relative to the Segment payload)"""
+    positions = {}
+    for element_id, start, end in _iter_elements(data):
+        if element_id != SEEK:
+            continue
+        seek = dict((child, (s, e)) for child, s, e in _iter_elements(data, start, end))
+        if SEEK_ID in seek and SEEK_POSITION in seek:
+            positions[_uint(data, *seek[SEEK_ID])] = _uint(data, *seek[SEEK_POSITION])
+    return positions
+
+
+async def _read_element_header(reader, offset):
+    head = await reader.read(offset, 12)
+    if len(head) < 2:
+        raise ProbeError(f"Unexpected end of file at {offset}")
+    element_id, id_length = _read_vint(head, 0, keep_marker=True)
+    size, size_length = _read_vint(head, id_length)
+    return element_id, offset + id_length + size_length, size
+
+
+async def _probe_mkv(reader):
+    """Read Info and Tracks from the Segment, jumping over Clusters.
+
+    Info and Tracks normally come before the first Cluster. If they don't,
+    the SeekHead says where they are, so media data is never scanned.
+    """
+    element_id, payload, size = await _read_element_header(reader, 0)
+    offset = payload + size
+    element_id, segment_start, segment_size = await _read_element_header(reader, offset)
+    if element_id != SEGMENT:
+        raise ProbeError("No Segment after the EBML header")
+    segment_end = reader.size if segment_size is None else min(segment_start + segment_size, reader.size)
+
+    info = {}
+    parsed = set()
+    seek_positions = {}
+    pending = [segment_start]
+    while pending:
+        offset = pending.pop(0)
+        while offset < segment_end:
+            element_id, payload, size = await _read_element_header(reader, offset)
+            if element_id in (INFO, TRACKS, SEEK_HEAD) and element_id not in parsed:
+                if size is None or size > Config.PROBE_MAX_HEADER:
+                    raise ProbeError("Header element is too large to probe")
+                data = await _read_exact(reader, payload, size)
+                parsed.add(element_id)
+                if element_id == INFO:
+                    info.update(_parse_info(data))
+                elif element_id == TRACKS:
+                    info.update(_parse_tracks(data))
+                else:
+                    seek_positions = _parse_seek_head(data)
+            if INFO in parsed and TRACKS in parsed:
+                return info
+            if element_id == CLUSTER or size is None:
+                # Media data starts here, jump to whatever the SeekHead lists
+                pending.extend(
+                    segment_start + seek_positions[target] for target in (INFO, TRACKS)
+                    if target not in parsed and target in seek_positions
+                    and segment_start + seek_positions[target] > offset
+                )
+                break
+            offset = payload + size
+    return info
+
+
+async def probe_video(reader):
+    """Duration (seconds), width and height of an MP4/MOV or MKV/WebM file.
+
+    Only the container headers are read: MP4 top level boxes are skipped by
+    their sizes until moov, Matroska Clusters are skipped by size or through
+    the SeekHead. Returns a dict with whichever of duration, width and height
+    were found, or {} for other formats and damaged files.
+    """
+    try:
+        magic = await reader.read(0, 12)
+        if len(magic) >= 8 and magic[4:8] in (b"ftyp", b"moov", b"free", b"mdat", b"wide", b"skip"):
+            return await _probe_mp4(reader)
+        if len(magic) >= 4 and struct.unpack(">I", magic[:4])[0] == EBML_HEADER:
+            return await _probe_mkv(reader)
+    except Exception as e:
+        logger.debug(f"Video probe failed: {e}")
+    return {}
+
+
+async def probe_file(path):
+    return await probe_video(FileReader(path))
+
+
+async def probe_buffer(buffer):
+    return await probe_video(BytesReader(buffer))
+
+
+async def probe_message(client, message, size):
+    return await probe_video(MessageReader(client, message, size))
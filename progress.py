@@ -0,0 +1,143 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from pyrogram.errors import FloodWait
+from config import Config
+from utils import get_size
+
+logger = logging.getLogger(__name__)
+
+
+def format_eta(seconds):
+    eta_min, eta_sec = divmod(int(seconds), 60)
+    eta_hr, eta_min = divmod(eta_min, 60)
+
+    if eta_hr > 0:
+        return f"{eta_hr} hr, {eta_min} min"
+    elif eta_min > 0:
+        return f"{eta_min} min, {eta_sec} sec"
+    return f"{eta_sec} sec"
+
+
+def render_progress(title, current, total, speed):
+    """Progress message with a 20 block bar, size, speed and ETA"""
+    percentage = (current / total) * 100 if total else 0
+    eta_seconds = (total - current) / speed if speed > 0 else 0
+
+    filled_blocks = int(percentage / 5)  # 20 blocks total (100/5)
+    progress_bar = "■" * filled_blocks + "□" * (20 - filled_blocks)
+
+    return (
+        f"<b>{title}</b>\n\n"
+        f"<code>{progress_bar}</code>\n\n"
+        f"📁 <b>Size :</b> {get_size(current)} / {get_size(total)}\n"
+        f"⏳️ <b>Done :</b> {percentage:.1f}%\n"
+        f"🚀 <b>Speed :</b> {get_size(speed)}/s\n"
+        f"⏰️ <b>ETA :</b> {format_eta(eta_seconds)}"
+    )
+
+
+class ProgressReporter:
+    """One place that turns transfer progress into status message edits.
+
+    Speed is a moving average over PROGRESS_SPEED_WINDOW seconds. Edits are
+    fire-and-forget (a slow edit never stalls a transfer), skipped when the
+    text would not change, and drawn from a global token bucket of
+    PROGRESS_EDITS_PER_SECOND. Each message's refresh interval grows with the
+    number of active messages so the whole bot stays inside that budget,
+    and a FloodWait on any edit pauses all of them.
+    """
+
+    def __init__(self, edits_per_second, min_interval, window):
+        self.edits_per_second = edits_per_second
+        self.min_interval = min_interval
+        self.window = window
+        self.tokens = edits_per_second
+        self.last_refill = time.monotonic()
+        self.paused_until = 0
+        self.states = {}
+        self.tasks = set()
+
+    def _take_token(self, now):
+        self.tokens = min(
+            self.edits_per_second,
+            self.tokens + (now - self.last_refill) * self.edits_per_second
+        )
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def interval(self):
+        """Seconds between edits of one message at the current load"""
+        return max(self.min_interval, len(self.states) / self.edits_per_second)
+
+    def _prune(self, now):
+        stale = [key for key, state in self.states.items() if now - state['seen'] > self.window * 6]
+        for key in stale:
+            del self.states[key]
+
+    def tracker(self, status_msg, title):
+        """A progress(current, total) callback reporting to status_msg"""
+        async def progress(current, total):
+            await self.update(status_msg, title, current, total)
+        return progress
+
+    async def update(self, status_msg, title, current, total):
+        """Record progress for status_msg and edit it if the budget allows"""
+        now = time.monotonic()
+        key = (status_msg.chat.id, status_msg.id)
+        state = self.states.get(key)
+        if state is None or state['title'] != title:
+            self._prune(now)
+            state = self.states[key] = {
+                'title': title,
+                'samples': deque(),
+                'last_edit': 0,
+                'text': None,
+                'editing': False
+            }
+
+        state['seen'] = now
+        samples = state['samples']
+        samples.append((now, current))
+        while len(samples) > 2 and now - samples[0][0] > self.window:
+            samples.popleft()
+
+        if state['editing'] or now < self.paused_until:
+            return
+        if now - state['last_edit'] < self.interval() and current < total:
+            return
+
+        first_time, first_bytes = samples[0]
+        speed = (current - first_bytes) / (now - first_time) if now > first_time else 0
+        text = render_progress(title, current, total, speed)
+        if text == state['text'] or not self._take_token(now):
+            return
+
+        state['last_edit'] = now
+        state['text'] = text
+        state['editing'] = True
+        task = asyncio.create_task(self._edit(status_msg, text, state))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _edit(self, status_msg, text, state):
+        try:
+            await status_msg.edit(text)
+        except FloodWait as e:
+            logger.warning(f"Progress edits paused for {e.value}s (FloodWait)")
+            self.paused_until = time.monotonic() + e.value
+        except Exception:
+            pass
+        finally:
+            state['editing'] = False
+
+
+reporter = ProgressReporter(
+    Config.PROGRESS_EDITS_PER_SECOND,
+    Config.PROGRESS_UPDATE_DELAY,
+    Config.PROGRESS_SPEED_WINDOW
+)
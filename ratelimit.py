@@ -0,0 +1,68 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    """Token bucket pacing for bulk sends that backs off on FloodWait.
+
+    acquire() hands out tokens at `rate` per second (bursts up to one
+    second's worth), in arrival order. A FloodWait pauses every sender for
+    the requested time and halves the rate, once per flood however many
+    sends in flight get it. After `step_after` successes in a row the rate
+    creeps back up by one message per second, never past max_rate. So the
+    rate settles just under whatever Telegram tolerates.
+    """
+
+    def __init__(self, max_rate, min_rate, step_after):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.step_after = step_after
+        self.rate = max_rate
+        self.tokens = max_rate
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.streak = 0
+        self.floods = 0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.streak += 1
+        if self.streak >= self.step_after and self.rate < self.max_rate:
+            self.streak = 0
+            self.rate = min(self.max_rate, self.rate + 1)
+
+    def on_flood(self, seconds):
+        now = time.monotonic()
+        self.streak = 0
+        self.tokens = 0
+        if now < self.paused_until:
+            # Another send already in flight hit the same FloodWait - extend
+            # the pause, but back off and count it only once per window
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.updated = self.paused_until
+            return
+        self.floods += 1
+        self.paused_until = now + seconds
+        self.updated = self.paused_until
+        self.rate = max(self.min_rate, self.rate / 2)
+        logger.warning(f"FloodWait {seconds}s - pausing sends, rate lowered to {self.rate:.1f}/s")
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import contextvars
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# The job whose func() is running in the current task
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class RenameScheduler:
+    """Global rename job queue with a premium lane and a free lane.
+
+    Each user's jobs run one after another (FIFO per user). A waiting job
+    starts once fewer than max_jobs are running and its size fits in the
+    in-flight byte budget. When both lanes have work, the next job is picked
+    by smooth weighted round robin, so premium jobs start PREMIUM_LANE_WEIGHT
+    times as often as free ones without free users being starved. A job that
+    does not fit blocks later jobs so big files cannot be starved either.
+
+    Pipelined jobs (batch renames) call handoff() when they move from
+    downloading to uploading, which lets the same user's next job start its
+    download while this one uploads. A user never has more than one job
+    downloading, and a new one only starts while fewer than two are uploading.
+    """
+
+    def __init__(self, max_jobs, max_bytes, weights):
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.weights = weights
+        self.lanes = {lane: [] for lane in weights}
+        self.credits = {lane: 0 for lane in weights}
+        self.busy_users = set()
+        self.uploading_users = {}
+        self.running = 0
+        self.running_lanes = {lane: 0 for lane in weights}
+        self.inflight_bytes = 0
+        self.tasks = set()
+
+    def _fits(self, job):
+        if self.running >= self.max_jobs:
+            return False
+        # A single job bigger than the whole budget may still run on its own
+        return self.running == 0 or self.inflight_bytes + job['size'] <= self.max_bytes
+
+    def _pick(self, lanes, credits):
+        """Smooth weighted round robin over the given lanes"""
+        total = sum(self.weights[lane] for lane in lanes)
+        for lane in lanes:
+            credits[lane] += self.weights[lane]
+        lane = max(lanes, key=lambda name: credits[name])
+        credits[lane] -= total
+        return lane
+
+    def _user_free(self, user_id):
+        return user_id not in self.busy_users and self.uploading_users.get(user_id, 0) < 2
+
+    def _next_job(self, lane):
+        for job in self.lanes[lane]:
+            if self._user_free(job['user_id']):
+                return job
+        return None
+
+    def _dispatch(self):
+        while self.running < self.max_jobs:
+            heads = {lane: self._next_job(lane) for lane in self.lanes}
+            ready = [lane for lane, job in heads.items() if job]
+            if not ready:
+                return
+
+            credits = dict(self.credits)
+            lane = self._pick(ready, credits)
+            job = heads[lane]
+            if not self._fits(job):
+                return
+
+            self.credits = credits
+            self.lanes[lane].remove(job)
+            self.busy_users.add(job['user_id'])
+            self.running += 1
+            self.running_lanes[lane] += 1
+            self.inflight_bytes += job['size']
+            job['started'].set()
+
+    def _release(self, job):
+        if job.get('handed_off'):
+            self._uploading(job['user_id'], -1)
+        else:
+            self.busy_users.discard(job['user_id'])
+        self.running -= 1
+        self.running_lanes[job['lane']] -= 1
+        self.inflight_bytes -= job['size']
+        self._dispatch()
+
+    def _uploading(self, user_id, delta):
+        count = self.uploading_users.get(user_id, 0) + delta
+        if count:
+            self.uploading_users[user_id] = count
+        else:
+            self.uploading_users.pop(user_id, None)
+
+    def handoff(self):
+        """Called by a running pipelined job once its download is done, so the
+        user's next job can start downloading while this one uploads"""
+        job = current_job.get()
+        if not job or not job['pipeline'] or job.get('handed_off'):
+            return
+        job['handed_off'] = True
+        self.busy_users.discard(job['user_id'])
+        self._uploading(job['user_id'], 1)
+        self._dispatch()
+
+    def position(self, job):
+        """1-based place of a waiting job in the expected start order"""
+        jobs = self.lanes[job['lane']]
+        if job not in jobs:
+            return 0
+
+        index = jobs.index(job)
+        remaining = {lane: len(waiting) for lane, waiting in self.lanes.items()}
+        credits = dict(self.credits)
+        position = 0
+        while True:
+            lane = self._pick([name for name, count in remaining.items() if count], credits)
+            position += 1
+            if lane == job['lane'] and len(jobs) - remaining[lane] == index:
+                return position
+            remaining[lane] -= 1
+
+    def transfer_share(self, premium):
+        """Fraction of the transfer engine (connections, sessions) a job gets.
+
+        Premium jobs always get the full engine. Free jobs are scaled down by
+        the lane weights only while premium work is running or waiting, so the
+        link is shared in the same ratio as job starts.
+        """
+        if premium:
+            return 1.0
+        if self.running_lanes['premium'] or self.lanes['premium']:
+            return self.weights['free'] / self.weights['premium']
+        return 1.0
+
+    async def run(self, user_id, size, func, on_queued=None, premium=False, pipeline=False):
+        """Wait for a slot, then run func(). on_queued(position) is awaited
+        whenever the job's queue position changes."""
+        job = {
+            'user_id': user_id,
+            'size': size,
+            'lane': 'premium' if premium else 'free',
+            'pipeline': pipeline,
+            'started': asyncio.Event()
+        }
+        self.lanes[job['lane']].append(job)
+        self._dispatch()
+
+        last_position = None
+        try:
+            while not job['started'].is_set():
+                position = self.position(job)
+                if on_queued and position != last_position:
+                    last_position = position
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        logger.debug(f"Queue position update failed: {e}")
+                try:
+                    await asyncio.wait_for(job['started'].wait(), Config.QUEUE_UPDATE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if job in self.lanes[job['lane']]:
+                self.lanes[job['lane']].remove(job)
+            else:
+                self._release(job)
+            raise
+
+        current_job.set(job)
+        try:
+            return await func()
+        finally:
+            self._release(job)
+
+    def submit(self, user_id, size, func, on_queued=None, premium=False, pipeline=False):
+        """Schedule a job in the background so the update handler returns at once"""
+        task = asyncio.create_task(self.run(user_id, size, func, on_queued, premium, pipeline))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+
+scheduler = RenameScheduler(
+    Config.MAX_CONCURRENT_JOBS,
+    Config.MAX_INFLIGHT_BYTES,
+    {'premium': Config.PREMIUM_LANE_WEIGHT, 'free': Config.FREE_LANE_WEIGHT}
+)
@@ -0,0 +1,265 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+from config import Config
+from utils import get_size
+from transfer import PARTS_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolFull(Exception):
+    """Raised when a download can never fit, or waited too long for disk space"""
+
+
+class SpoolManager:
+    """Admission control for files downloaded under DOWNLOAD_LOCATION.
+
+    Every download reserves its full size before the first byte arrives and
+    gets its own job directory with the file preallocated, so a burst of big
+    files can't fill the disk halfway through. Reservations that don't fit in
+    the budget (or in the real free space) wait until others are released.
+    """
+
+    def __init__(self, root, budget, min_free):
+        self.root = root
+        self.budget = budget
+        self.min_free = min_free
+        self.reservations = {}
+        self.condition = asyncio.Condition()
+
+    @property
+    def reserved(self):
+        return sum(self.reservations.values())
+
+    def _available(self):
+        os.makedirs(self.root, exist_ok=True)
+        # Preallocated files already count against the real free space
+        disk_free = shutil.disk_usage(self.root).free - self.min_free
+        return min(self.budget - self.reserved, disk_free)
+
+    def _preallocate(self, path, size):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if size and hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    async def reserve(self, file_name, size, on_wait=None, timeout=None, key=None):
+        """Reserve size bytes and return a preallocated path for file_name.
+
+        on_wait() is awaited once if the job has to wait for space. With a key
+        (the source file_unique_id) the job directory is stable, so a partial
+        download kept by an earlier attempt is picked up again.
+        """
+        if size > self.budget:
+            raise SpoolFull(f"File is larger than the {get_size(self.budget)} download budget")
+
+        deadline = time.monotonic() + (timeout or Config.SPOOL_WAIT_TIMEOUT)
+        notified = False
+
+        while True:
+            async with self.condition:
+                if self._available() >= size:
+                    job_dir = os.path.join(self.root, key or uuid.uuid4().hex)
+                    if job_dir in self.reservations:
+                        job_dir = os.path.join(self.root, uuid.uuid4().hex)
+                    self.reservations[job_dir] = size
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SpoolFull("Timed out waiting for free disk space")
+                if notified or not on_wait:
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), min(remaining, 30))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+            # Outside the lock - a slow status edit must not hold up releases
+            notified = True
+            await on_wait()
+
+        path = os.path.join(job_dir, os.path.basename(file_name))
+        try:
+            self._prepare(job_dir, path)
+            await asyncio.get_running_loop().run_in_executor(None, self._preallocate, path, size)
+        except BaseException:
+            await self.release(path)
+            raise
+        return path
+
+    def _prepare(self, job_dir, path):
+        """Create the job directory, keeping only a resumable copy of path"""
+        os.makedirs(job_dir, exist_ok=True)
+        keep = {path, path + PARTS_SUFFIX} if os.path.exists(path + PARTS_SUFFIX) else set()
+        for name in os.listdir(job_dir):
+            entry = os.path.join(job_dir, name)
+            if entry in keep:
+                continue
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            else:
+                os.remove(entry)
+
+    async def release(self, path, keep_partial=False):
+        """Give a reservation's bytes back and delete its job directory.
+
+        With keep_partial, an unfinished download (one that still has its
+        .parts checkpoint) stays on disk so a retry can resume it.
+        """
+        job_dir = os.path.dirname(path)
+        if not (keep_partial and Config.RESUME_DOWNLOADS and os.path.exists(path + PARTS_SUFFIX)):
+            shutil.rmtree(job_dir, ignore_errors=True)
+        async with self.condition:
+            self.reservations.pop(job_dir, None)
+            self.condition.notify_all()
+
+    def _resumable(self, job_dir):
+        """A job directory holding a recent partial download worth resuming"""
+        if not Config.RESUME_DOWNLOADS or not os.path.isdir(job_dir):
+            return False
+        for name in os.listdir(job_dir):
+            if name.endswith(PARTS_SUFFIX):
+                age = time.time() - os.path.getmtime(os.path.join(job_dir, name))
+                return age < Config.RESUME_MAX_AGE
+        return False
+
+    def cleanup_orphans(self):
+        """Remove files left behind by a crash (anything not reserved now),
+        except recent partial downloads that can still be resumed"""
+        if not os.path.isdir(self.root):
+            return 0
+
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path in self.reservations or self._resumable(path):
+                continue
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+            except Exception as e:
+                logger.warning(f"Failed to remove orphaned spool entry {path}: {e}")
+        return removed
+
+
+class MemoryPool:
+    """Global cap on bytes held in memory by small-file renames.
+
+    Reservations never wait: a job that doesn't fit right now simply takes
+    the disk / streaming path instead.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.reserved = 0
+
+    def try_reserve(self, size):
+        if self.reserved + size > self.budget:
+            return False
+        self.reserved += size
+        return True
+
+    def release(self, size):
+        self.reserved = max(0, self.reserved - size)
+
+
+class SharedDownloads:
+    """Single-flight downloads keyed by file_unique_id.
+
+    Jobs that want the same source file while it is being downloaded share
+    that one download and its spool file. Every job holds a reference until
+    its upload is done; the file is released only by the last one.
+
+    Jobs also register with want(key) from the moment they are queued, so a
+    job can tell that another one wants the same file and take the shared
+    disk path instead of streaming a private copy.
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.flights = {}
+        self.demand = {}
+
+    def want(self, key):
+        self.demand[key] = self.demand.get(key, 0) + 1
+
+    def unwant(self, key):
+        count = self.demand.get(key, 0) - 1
+        if count > 0:
+            self.demand[key] = count
+        else:
+            self.demand.pop(key, None)
+
+    def contended(self, key):
+        """Another job is downloading, or queued or running for, this file"""
+        return key in self.flights or self.demand.get(key, 0) > 1
+
+    async def acquire(self, key, download, progress=None):
+        """Return the path of key's file, starting download(progress) if no
+        other job is fetching it. Pair every successful call with release(key)."""
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = {'refs': 0, 'listeners': [], 'task': None}
+
+            async def fan_out(current, total):
+                for listener in list(flight['listeners']):
+                    try:
+                        await listener(current, total)
+                    except Exception:
+                        pass
+
+            def forget_failed(task):
+                if (task.cancelled() or task.exception()) and self.flights.get(key) is flight:
+                    del self.flights[key]
+
+            flight['task'] = asyncio.ensure_future(download(fan_out))
+            flight['task'].add_done_callback(forget_failed)
+            self.flights[key] = flight
+
+        flight['refs'] += 1
+        if progress:
+            flight['listeners'].append(progress)
+
+        try:
+            return await asyncio.shield(flight['task'])
+        except BaseException:
+            await self._drop(key, flight)
+            raise
+        finally:
+            if progress in flight['listeners']:
+                flight['listeners'].remove(progress)
+
+    async def release(self, key):
+        flight = self.flights.get(key)
+        if flight:
+            await self._drop(key, flight)
+
+    async def _drop(self, key, flight):
+        flight['refs'] -= 1
+        if flight['refs'] > 0:
+            return
+
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+        task = flight['task']
+        if not task.done():
+            # Nobody is waiting for it any more
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            await self.spool.release(task.result())
+
+
+spool = SpoolManager(Config.DOWNLOAD_LOCATION, Config.SPOOL_BUDGET, Config.SPOOL_MIN_FREE)
+shared_downloads = SharedDownloads(spool)
+memory_pool = MemoryPool(Config.MEMORY_RENAME_BUDGET)
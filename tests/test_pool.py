@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+
+from pool import ClientPool
+
+
+class FakeClient:
+    """Offline stand-in for a helper Client - only what ClientPool touches"""
+
+    def __init__(self, name, fail_start=False):
+        self.name = name
+        self.fail_start = fail_start
+        self.is_connected = False
+        self.starts = 0
+
+    async def start(self):
+        self.starts += 1
+        if self.fail_start:
+            raise ConnectionError(f"{self.name} failed to start")
+        self.is_connected = True
+
+    async def stop(self):
+        self.is_connected = False
+
+
+class ClientPoolTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.main = FakeClient("main")
+        self.helpers = [FakeClient("helper_1"), FakeClient("helper_2")]
+        self.pool = ClientPool(self.helpers)
+
+    async def test_helpers_win_ties(self):
+        async with self.pool.lease(self.main, 100) as client:
+            self.assertIn(client, self.helpers)
+            self.assertTrue(client.is_connected)
+
+    async def test_spreads_concurrent_leases(self):
+        leased = []
+        release = asyncio.Event()
+
+        async def hold(size):
+            async with self.pool.lease(self.main, size) as client:
+                leased.append(client)
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold(10)) for _ in range(3)]
+        await asyncio.sleep(0)
+        while len(leased) < 3:
+            await asyncio.sleep(0)
+        self.assertEqual(set(leased), {self.main, *self.helpers})
+
+        release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(self.pool.load, {})
+
+    async def test_fewer_bytes_in_flight_wins(self):
+        async with self.pool.lease(self.main, 1000) as first, \
+                self.pool.lease(self.main, 10) as second, \
+                self.pool.lease(self.main, 500) as third:
+            self.assertEqual([first, second, third], [*self.helpers, self.main])
+            # Every client runs one job now - the fewest bytes in flight wins
+            async with self.pool.lease(self.main, 1) as fourth:
+                self.assertIs(fourth, self.helpers[1])
+
+    async def test_failed_helper_is_skipped(self):
+        self.helpers[0].fail_start = True
+        for _ in range(3):
+            async with self.pool.lease(self.main, 10) as client:
+                self.assertIsNot(client, self.helpers[0])
+        self.assertIn(self.helpers[0], self.pool.failed)
+        self.assertEqual(self.helpers[0].starts, 1)
+
+    async def test_helpers_start_once_and_stop(self):
+        for _ in range(4):
+            async with self.pool.lease(self.main, 10):
+                pass
+        self.assertEqual(sum(helper.starts for helper in self.helpers), 1)
+        await self.pool.stop()
+        self.assertFalse(any(helper.is_connected for helper in self.helpers))
+
+
+if __name__ == "__main__":
+    unittest.main()
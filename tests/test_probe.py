@@ -0,0 +1,122 @@
+import io
+import os
+import struct
+import unittest
+from unittest import mock
+
+import probe
+from config import Config
+
+
+def box(kind, payload):
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def mp4(width, height, seconds, timescale=1000, rotated=False, mdat_size=200_000):
+    """ftyp, a 64-bit sized mdat, then moov - the layout of an unoptimised upload"""
+    mvhd = box(b"mvhd", bytes(4) + bytes(8) + struct.pack(">II", timescale, seconds * timescale) + bytes(80))
+    if rotated:
+        matrix = struct.pack(">9i", 0, 65536, 0, -65536, 0, 0, 0, 0, 1 << 30)
+    else:
+        matrix = struct.pack(">9i", 65536, 0, 0, 0, 65536, 0, 0, 0, 1 << 30)
+    tkhd = box(b"tkhd", bytes(4) + bytes(36) + matrix + struct.pack(">II", width << 16, height << 16))
+    audio = box(b"trak", box(b"tkhd", bytes(84)) + box(b"mdia", box(b"hdlr", bytes(8) + b"soun" + bytes(12))))
+    video = box(b"trak", tkhd + box(b"mdia", box(b"hdlr", bytes(8) + b"vide" + bytes(12))))
+    mdat = struct.pack(">I4sQ", 1, b"mdat", 16 + mdat_size) + os.urandom(mdat_size)
+    return box(b"ftyp", b"isom" + bytes(4)) + mdat + box(b"moov", mvhd + audio + video)
+
+
+def element(element_id, payload):
+    encoded_id = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return encoded_id + b"\x01" + len(payload).to_bytes(7, "big") + payload
+
+
+def mkv(width, height, seconds, tracks_after_clusters=False, cluster_size=100_000):
+    info = element(probe.INFO, element(probe.TIMECODE_SCALE, (1000000).to_bytes(3, "big"))
+                   + element(probe.DURATION, struct.pack(">d", seconds * 1000.0)))
+    tracks = element(probe.TRACKS, element(probe.TRACK_ENTRY, element(probe.TRACK_TYPE, b"\x02"))
+                     + element(probe.TRACK_ENTRY, element(probe.TRACK_TYPE, b"\x01") + element(
+                         probe.VIDEO,
+                         element(probe.PIXEL_WIDTH, width.to_bytes(2, "big"))
+                         + element(probe.PIXEL_HEIGHT, height.to_bytes(2, "big")))))
+    clusters = b"".join(element(probe.CLUSTER, os.urandom(cluster_size)) for _ in range(5))
+
+    def seek_head(info_position, tracks_position):
+        return element(probe.SEEK_HEAD, b"".join(
+            element(probe.SEEK, element(probe.SEEK_ID, target.to_bytes(4, "big"))
+                    + element(probe.SEEK_POSITION, position.to_bytes(8, "big")))
+            for target, position in ((probe.INFO, info_position), (probe.TRACKS, tracks_position))
+        ))
+
+    if tracks_after_clusters:
+        # The SeekHead is a fixed size, so its own length gives the positions
+        head_size = len(seek_head(0, 0))
+        body = seek_head(head_size, head_size + len(info) + len(clusters)) + info + clusters + tracks
+    else:
+        body = info + tracks + clusters
+    return element(probe.EBML_HEADER, b"\x42\x86\x81\x01") + element(probe.SEGMENT, body)
+
+
+class CountingReader(probe.BytesReader):
+    def __init__(self, data):
+        super().__init__(io.BytesIO(data))
+        self.bytes_read = 0
+
+    async def read(self, offset, size):
+        data = await super().read(offset, size)
+        self.bytes_read += len(data)
+        return data
+
+
+class ProbeTest(unittest.IsolatedAsyncioTestCase):
+    async def probe(self, data):
+        reader = CountingReader(data)
+        return await probe.probe_video(reader), reader
+
+    async def test_mp4_moov_after_mdat(self):
+        info, reader = await self.probe(mp4(1920, 1080, 125, timescale=90000))
+        self.assertEqual(info, {'duration': 125, 'width': 1920, 'height': 1080})
+        # mdat is skipped by its size, never read
+        self.assertLess(reader.bytes_read, 2000)
+
+    async def test_mp4_rotated_90_degrees(self):
+        info, _ = await self.probe(mp4(1920, 1080, 60, rotated=True))
+        self.assertEqual(info, {'duration': 60, 'width': 1080, 'height': 1920})
+
+    async def test_mkv_tracks_before_clusters(self):
+        info, reader = await self.probe(mkv(1280, 720, 61.6))
+        self.assertEqual(info, {'duration': 62, 'width': 1280, 'height': 720})
+        self.assertLess(reader.bytes_read, 2000)
+
+    async def test_mkv_tracks_after_cluster_via_seek_head(self):
+        info, reader = await self.probe(mkv(640, 360, 10, tracks_after_clusters=True))
+        self.assertEqual(info, {'duration': 10, 'width': 640, 'height': 360})
+        self.assertLess(reader.bytes_read, 2000)
+
+    async def test_truncated_mp4(self):
+        data = mp4(1920, 1080, 60)
+        info, _ = await self.probe(data[:-50])
+        self.assertEqual(info, {})
+
+    async def test_truncated_mkv(self):
+        data = mkv(640, 360, 10, tracks_after_clusters=True)
+        info, _ = await self.probe(data[:-20])
+        self.assertEqual(info, {})
+
+    async def test_oversized_mp4_header(self):
+        with mock.patch.object(Config, "PROBE_MAX_HEADER", 64):
+            info, _ = await self.probe(mp4(1920, 1080, 60))
+        self.assertEqual(info, {})
+
+    async def test_oversized_mkv_header(self):
+        with mock.patch.object(Config, "PROBE_MAX_HEADER", 16):
+            info, _ = await self.probe(mkv(640, 360, 10))
+        self.assertEqual(info, {})
+
+    async def test_unknown_format(self):
+        info, _ = await self.probe(b"not a video file at all")
+        self.assertEqual(info, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
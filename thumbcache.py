@@ -0,0 +1,127 @@
+import io
+import os
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pyrogram.file_id import FileId, FileUniqueId, FileUniqueType
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def resize_thumbnail(data, max_side, max_bytes):
+    """Turn any image into a JPEG within Telegram's thumbnail limits.
+
+    Runs in a worker process, so it only takes and returns bytes.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+
+        for quality in (90, 80, 70, 60, 50, 40, 30):
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=quality, optimize=True)
+            if out.tell() <= max_bytes:
+                break
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    """Pre-resized user thumbnails on local disk, keyed by file_unique_id.
+
+    A photo is downloaded and resized once (when the user saves it, or on the
+    first upload after a restart), then every rename reuses the local JPEG.
+    The directory is kept under max_bytes by evicting the least recently
+    used files; a cache hit refreshes the file's mtime.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.pending = {}
+        self.executor = None
+
+    def _key(self, file_id):
+        media_id = FileId.decode(file_id).media_id
+        return FileUniqueId(file_unique_type=FileUniqueType.DOCUMENT, media_id=media_id).encode()
+
+    def _path(self, file_id):
+        return os.path.join(self.root, f"{self._key(file_id)}.jpg")
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def _write(self, path, data):
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self._evict()
+
+    async def _fetch(self, client, file_id, path):
+        photo = await client.download_media(file_id, in_memory=True)
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=Config.THUMB_WORKERS)
+        data = await loop.run_in_executor(
+            self.executor,
+            resize_thumbnail,
+            bytes(photo.getbuffer()),
+            Config.THUMB_MAX_SIDE,
+            Config.THUMB_MAX_BYTES
+        )
+        await loop.run_in_executor(None, self._write, path, data)
+        return path
+
+    async def get(self, client, file_id):
+        """Local path of the resized thumbnail for a photo file_id, fetching
+        it if needed. Returns None if it can't be fetched or resized."""
+        try:
+            path = self._path(file_id)
+        except Exception as e:
+            logger.warning(f"Invalid thumbnail file_id: {e}")
+            return None
+
+        try:
+            # Touch it for the LRU - eviction may delete it at any moment
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        # Concurrent uploads with the same thumbnail share one fetch
+        task = self.pending.get(path)
+        if task is None:
+            task = self.pending[path] = asyncio.ensure_future(self._fetch(client, file_id, path))
+            task.add_done_callback(lambda _: self.pending.pop(path, None))
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            logger.warning(f"Thumbnail cache fetch failed: {e}")
+            return None
+
+    def discard(self, file_id):
+        try:
+            os.remove(self._path(file_id))
+        except Exception:
+            pass
+
+
+thumb_cache = ThumbnailCache(Config.THUMB_CACHE_DIR, Config.THUMB_CACHE_MAX)
@@ -0,0 +1,554 @@
+import os
+import math
+import asyncio
+import logging
+from hashlib import md5
+from pyrogram import raw, types
+from pyrogram import utils as pyrogram_utils
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session, Auth
+from pyrogram.file_id import FileId
+from config import Config
+from probe import probe_message
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024  # Largest upload part Telegram accepts
+BIG_FILE_SIZE = 10 * 1024 * 1024  # Bigger files must use SaveBigFilePart
+PARTS_SUFFIX = ".parts"  # Sidecar listing finished chunks of a partial download
+
+
+def scaled(value, share):
+    """Scale a connection count by a bandwidth share, keeping at least one"""
+    return max(1, round(value * share))
+
+
+async def iter_parts(chunks, part_size=PART_SIZE, on_end=None):
+    """Re-slice an async stream of byte chunks into fixed size upload parts.
+    on_end() is called as soon as the chunk stream is exhausted."""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if on_end:
+        on_end()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _put(queue, item, workers):
+    """Queue an item, failing fast if a worker died while we were waiting"""
+    put = asyncio.ensure_future(queue.put(item))
+    done, _ = await asyncio.wait([put, *workers], return_when=asyncio.FIRST_COMPLETED)
+    if put not in done:
+        put.cancel()
+        for task in done:
+            task.result()
+        raise RuntimeError("Upload worker stopped unexpectedly")
+
+
+async def _gather_or_cancel(tasks):
+    """Wait for all tasks, cancelling the rest as soon as one of them fails"""
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def chunk_runs(indexes):
+    """Compress chunk indexes into sorted [first, count] runs"""
+    runs = []
+    for index in sorted(indexes):
+        if runs and runs[-1][0] + runs[-1][1] == index:
+            runs[-1][1] += 1
+        else:
+            runs.append([index, 1])
+    return runs
+
+
+def split_ranges(missing, connections):
+    """Split missing chunk indexes into contiguous ranges of similar size"""
+    if not missing:
+        return []
+    piece = math.ceil(len(missing) / connections)
+    ranges = []
+    for first, count in chunk_runs(missing):
+        while count > 0:
+            ranges.append((first, min(piece, count)))
+            first += piece
+            count -= piece
+    return ranges
+
+
+def read_checkpoint(sidecar):
+    """Chunk indexes recorded as finished in a .parts sidecar file"""
+    try:
+        with open(sidecar) as f:
+            return {int(line) for line in f if line.strip().isdigit()}
+    except FileNotFoundError:
+        return set()
+
+
+async def parallel_download(client, message, file_path, file_size, progress=None, connections=None, share=1.0):
+    """Download a message's media into file_path over several media sessions.
+
+    The missing chunks are split into contiguous ranges of CHUNK_SIZE chunks,
+    each range is streamed on its own session and written in place with
+    os.pwrite, so chunks never need to arrive in order.
+
+    Every finished chunk is appended to a file_path + ".parts" sidecar. If the
+    sidecar is already there (an earlier attempt died halfway) only the chunks
+    it doesn't list are fetched. The sidecar is removed once the file is
+    complete.
+    """
+    chunk_size = Config.CHUNK_SIZE
+    total_chunks = max(1, math.ceil(file_size / chunk_size))
+    sidecar = file_path + PARTS_SUFFIX
+    done = {i for i in read_checkpoint(sidecar) if i < total_chunks} if os.path.exists(file_path) else set()
+    missing = [i for i in range(total_chunks) if i not in done]
+    connections = min(connections or scaled(Config.DOWNLOAD_CONNECTIONS, share), max(1, len(missing)))
+    ranges = split_ranges(missing, connections)
+    loop = asyncio.get_running_loop()
+    downloaded = min(len(done) * chunk_size, file_size)
+
+    if done:
+        logger.info(f"Resuming {file_path}: {len(missing)} of {total_chunks} chunks missing")
+
+    async def worker():
+        nonlocal downloaded
+        while ranges:
+            index, count = ranges.pop(0)
+            async for chunk in client.stream_media(message, offset=index, limit=count):
+                await loop.run_in_executor(None, os.pwrite, fd, chunk, index * chunk_size)
+                parts.write(f"{index}\n")
+                parts.flush()
+                done.add(index)
+                index += 1
+                downloaded += len(chunk)
+                if progress:
+                    await progress(min(downloaded, file_size), file_size)
+
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT, 0o644)
+    parts = open(sidecar, "a")
+    try:
+        os.ftruncate(fd, file_size)
+        await _gather_or_cancel([asyncio.create_task(worker()) for _ in range(connections)])
+    finally:
+        os.close(fd)
+        parts.close()
+
+    if len(done) < total_chunks:
+        raise IOError(f"Download incomplete: {total_chunks - len(done)} chunks missing")
+
+    os.remove(sidecar)
+    return file_path
+
+
+class CdnRedirect(Exception):
+    """upload.GetFile answered with a CDN redirect"""
+
+
+def file_location(message):
+    """dc_id and raw file location of a message's document, video or audio"""
+    media = message.document or message.video or message.audio
+    file_id = FileId.decode(media.file_id)
+    return file_id.dc_id, raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=file_id.thumbnail_size
+    )
+
+
+async def open_media_sessions(client, dc_id, count):
+    """Start count media sessions to dc_id sharing one auth key.
+
+    For a file on another DC that is one key exchange and one authorization
+    import for the whole set, instead of one per stream_media call.
+    """
+    test_mode = await client.storage.test_mode()
+    home = dc_id == await client.storage.dc_id()
+    auth_key = await client.storage.auth_key() if home else await Auth(client, dc_id, test_mode).create()
+    sessions = [Session(client, dc_id, auth_key, test_mode, is_media=True) for _ in range(count)]
+    try:
+        await asyncio.gather(*[session.start() for session in sessions])
+        if not home:
+            exported = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+            await sessions[0].invoke(raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes))
+    except BaseException:
+        await asyncio.gather(*[session.stop() for session in sessions], return_exceptions=True)
+        raise
+    return sessions
+
+
+async def get_chunk(session, location, index):
+    """Fetch chunk number index of a file over an open media session"""
+    r = await session.invoke(
+        raw.functions.upload.GetFile(
+            location=location,
+            offset=index * Config.CHUNK_SIZE,
+            limit=Config.CHUNK_SIZE
+        ),
+        sleep_threshold=30
+    )
+    if not isinstance(r, raw.types.upload.File):
+        raise CdnRedirect()
+    return r.bytes
+
+
+async def parallel_stream(client, message, file_size, connections=None, share=1.0):
+    """Yield a message's media chunk by chunk, in order, fetching ahead over
+    several media sessions.
+
+    Every connection keeps one media session open for the whole file and
+    sends upload.GetFile for its chunks through it. The file is cut into
+    ranges of STREAM_RANGE_CHUNKS chunks; a connection claims the next
+    range and parks its chunks until the consumer reaches them. No range is
+    started more than `connections` ranges ahead of the consumer, so memory
+    stays bounded and a slow uploader pauses the downloads too. Files served
+    from a CDN fall back to plain stream_media.
+    """
+    chunk_size = Config.CHUNK_SIZE
+    span = Config.STREAM_RANGE_CHUNKS
+    total_chunks = max(1, math.ceil(file_size / chunk_size))
+    connections = min(connections or scaled(Config.DOWNLOAD_CONNECTIONS, share), math.ceil(total_chunks / span))
+    if connections <= 1:
+        async for chunk in client.stream_media(message):
+            yield chunk
+        return
+
+    dc_id, location = file_location(message)
+    sessions = await open_media_sessions(client, dc_id, connections)
+    try:
+        # The first chunk tells whether the file comes from a CDN
+        first_chunk = await get_chunk(sessions[0], location, 0)
+    except CdnRedirect:
+        await asyncio.gather(*[session.stop() for session in sessions], return_exceptions=True)
+        async for chunk in client.stream_media(message):
+            yield chunk
+        return
+    except BaseException:
+        await asyncio.gather(*[session.stop() for session in sessions], return_exceptions=True)
+        raise
+
+    chunks = {0: first_chunk}
+    position = 0  # Next chunk index the consumer wants
+    next_index = 1
+    failure = None
+    changed = asyncio.Condition()
+
+    async def worker(session):
+        nonlocal next_index, failure
+        try:
+            while True:
+                async with changed:
+                    await changed.wait_for(lambda: next_index < position + connections * span)
+                    first = next_index
+                    if first >= total_chunks:
+                        return
+                    next_index = min(first + span, total_chunks)
+                for index in range(first, min(first + span, total_chunks)):
+                    chunk = await get_chunk(session, location, index)
+                    if not chunk:
+                        raise IOError(f"Download stream ended early at chunk {index}")
+                    async with changed:
+                        chunks[index] = chunk
+                        changed.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            async with changed:
+                failure = e
+                changed.notify_all()
+
+    workers = [asyncio.create_task(worker(session)) for session in sessions]
+    try:
+        while position < total_chunks:
+            async with changed:
+                await changed.wait_for(lambda: position in chunks or failure)
+                if position not in chunks:
+                    raise failure
+                chunk = chunks.pop(position)
+                position += 1
+                changed.notify_all()
+            yield chunk
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await asyncio.gather(*[session.stop() for session in sessions], return_exceptions=True)
+
+
+async def read_file_parts(file_path, read_ahead=None):
+    """Yield upload parts from a local file, reading several parts per disk read.
+
+    Reads run in the default executor so a slow disk never blocks the loop,
+    and the next block is already being read while the current one is consumed.
+    """
+    block_size = PART_SIZE * (read_ahead or Config.UPLOAD_READ_AHEAD)
+    loop = asyncio.get_running_loop()
+
+    with open(file_path, "rb") as fp:
+        pending = loop.run_in_executor(None, fp.read, block_size)
+        while True:
+            block = await pending
+            if not block:
+                return
+            pending = loop.run_in_executor(None, fp.read, block_size)
+            for start in range(0, len(block), PART_SIZE):
+                yield block[start:start + PART_SIZE]
+
+
+async def read_buffer_parts(buffer):
+    """Yield upload parts from an in-memory file without copying it first"""
+    view = buffer.getbuffer()
+    try:
+        for start in range(0, len(view), PART_SIZE):
+            yield bytes(view[start:start + PART_SIZE])
+    finally:
+        view.release()
+
+
+async def _save_part(session, rpc):
+    """Send one part, retrying just that part on transient failures"""
+    for attempt in range(Config.UPLOAD_PART_RETRIES):
+        try:
+            return await session.invoke(rpc)
+        except FloodWait:
+            raise
+        except Exception as e:
+            if attempt == Config.UPLOAD_PART_RETRIES - 1:
+                raise
+            logger.warning(f"Upload part {rpc.file_part} failed ({e}), retrying...")
+            await asyncio.sleep(2 ** attempt)
+
+
+async def upload_stream(client, parts, file_size, file_name, progress=None, share=1.0):
+    """Upload parts from an async iterator while they are still being produced.
+
+    Parts go through a bounded queue, so the producer (a download or a file
+    reader) is paused whenever the senders fall behind and memory stays at
+    STREAM_BUFFER_PARTS * PART_SIZE. Big files are spread over UPLOAD_SESSIONS
+    media sessions with UPLOAD_WORKERS parts in flight, and a failed part is
+    retried on its own. share scales both counts down for lower priority
+    jobs. Returns the raw InputFile to send.
+    """
+    file_total_parts = math.ceil(file_size / PART_SIZE)
+    is_big = file_size > BIG_FILE_SIZE
+    file_id = client.rnd_id()
+    md5_sum = None if is_big else md5()
+    queue = asyncio.Queue(Config.STREAM_BUFFER_PARTS)
+    uploaded = 0
+
+    dc_id = await client.storage.dc_id()
+    auth_key = await client.storage.auth_key()
+    test_mode = await client.storage.test_mode()
+    sessions = [
+        Session(client, dc_id, auth_key, test_mode, is_media=True)
+        for _ in range(scaled(Config.UPLOAD_SESSIONS, share) if is_big else 1)
+    ]
+
+    async def worker(session):
+        nonlocal uploaded
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+
+            file_part, chunk = item
+            if is_big:
+                rpc = raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id,
+                    file_part=file_part,
+                    file_total_parts=file_total_parts,
+                    bytes=chunk
+                )
+            else:
+                rpc = raw.functions.upload.SaveFilePart(
+                    file_id=file_id,
+                    file_part=file_part,
+                    bytes=chunk
+                )
+            await _save_part(session, rpc)
+
+            uploaded += len(chunk)
+            if progress:
+                await progress(min(uploaded, file_size), file_size)
+
+    workers = []
+    try:
+        await asyncio.gather(*[session.start() for session in sessions])
+        workers = [
+            asyncio.create_task(worker(sessions[i % len(sessions)]))
+            for i in range(scaled(Config.UPLOAD_WORKERS, share))
+        ]
+
+        file_part = 0
+        async for chunk in parts:
+            if md5_sum:
+                md5_sum.update(chunk)
+            await _put(queue, (file_part, chunk), workers)
+            file_part += 1
+
+        if file_part != file_total_parts:
+            raise ValueError(f"Expected {file_total_parts} parts but got {file_part}")
+
+        for _ in workers:
+            await _put(queue, None, workers)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await asyncio.gather(*[session.stop() for session in sessions], return_exceptions=True)
+
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=file_total_parts, name=file_name)
+
+    return raw.types.InputFile(
+        id=file_id,
+        parts=file_total_parts,
+        name=file_name,
+        md5_checksum=md5_sum.hexdigest()
+    )
+
+
+async def upload_file(client, file_path, file_name=None, progress=None, share=1.0):
+    """Upload a local file with the concurrent part uploader"""
+    return await upload_stream(
+        client,
+        read_file_parts(file_path),
+        os.path.getsize(file_path),
+        file_name or os.path.basename(file_path),
+        progress=progress,
+        share=share
+    )
+
+
+async def upload_buffer(client, buffer, progress=None, share=1.0):
+    """Upload an in-memory file (BytesIO) under its name attribute"""
+    return await upload_stream(
+        client,
+        read_buffer_parts(buffer),
+        buffer.getbuffer().nbytes,
+        buffer.name,
+        progress=progress,
+        share=share
+    )
+
+
+async def send_uploaded(client, message, file, file_name, as_video, thumb=None, caption=None, video_info=None):
+    """Send an already uploaded InputFile as a reply to message.
+
+    thumb may be a raw InputFile, a local path / BinaryIO, or a Telegram
+    photo file_id which is fetched into memory first. video_info is the
+    probe.probe_video() result used for the video duration and size.
+    """
+    if isinstance(thumb, str) and not os.path.isfile(thumb):
+        thumb = await client.download_media(thumb, in_memory=True)
+    if thumb is not None and not isinstance(thumb, (raw.types.InputFile, raw.types.InputFileBig)):
+        thumb = await client.save_file(thumb)
+
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if as_video:
+        video_info = video_info or {}
+        attributes.insert(0, raw.types.DocumentAttributeVideo(
+            supports_streaming=True,
+            duration=video_info.get('duration', 0),
+            w=video_info.get('width', 0),
+            h=video_info.get('height', 0)
+        ))
+
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=client.guess_mime_type(file_name) or ("video/mp4" if as_video else "application/zip"),
+        file=file,
+        force_file=None if as_video else True,
+        thumb=thumb,
+        attributes=attributes
+    )
+
+    r = await client.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(message.chat.id),
+            media=media,
+            reply_to_msg_id=message.id,
+            random_id=client.rnd_id(),
+            **await pyrogram_utils.parse_text_entities(client, caption, None, None)
+        )
+    )
+
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message,
+                {i.id: i for i in r.users},
+                {i.id: i for i in r.chats}
+            )
+
+
+async def stream_rename(client, source_message, file_size, reply_to, new_name, as_video,
+                        thumb=None, caption=None, progress=None, share=1.0, on_downloaded=None):
+    """Rename by piping stream_media chunks straight into the part uploader.
+
+    Upload starts with the first downloaded chunk and nothing touches the disk.
+    The download runs over several media sessions (parallel_stream). Videos
+    are probed from their container headers alongside the upload.
+    on_downloaded() is called once the last chunk has arrived, while the
+    final parts are still being uploaded.
+    """
+    probe = asyncio.ensure_future(probe_message(client, source_message, file_size)) if as_video else None
+    chunks = parallel_stream(client, source_message, file_size, share=share)
+    parts = iter_parts(chunks, on_end=on_downloaded)
+    try:
+        file = await upload_stream(client, parts, file_size, new_name, progress=progress, share=share)
+    except BaseException:
+        if probe:
+            probe.cancel()
+        raise
+    finally:
+        # Stops the range workers if the upload gave up early
+        await chunks.aclose()
+    video_info = await probe if probe else None
+    return await send_uploaded(client, reply_to, file, new_name, as_video, thumb=thumb, caption=caption,
+                               video_info=video_info)
+
+
+async def relay_rename(client, helper, source_message, file_size, reply_to, new_name, as_video,
+                       thumb=None, caption=None, progress=None, share=1.0, on_downloaded=None):
+    """stream_rename carried out by a helper bot.
+
+    Bots can't use each other's file_ids or uploads, so the source is copied
+    into BIN_CHANNEL for the helper to read, the helper sends the renamed
+    file there, and the main bot copies that to the user. Both relay
+    messages are deleted afterwards.
+    """
+    relay = await source_message.copy(Config.BIN_CHANNEL)
+    uploaded = None
+    try:
+        source = await helper.get_messages(Config.BIN_CHANNEL, relay.id)
+        if isinstance(thumb, str) and not os.path.isfile(thumb):
+            # A thumbnail file_id only works for the bot that owns it
+            thumb = await client.download_media(thumb, in_memory=True)
+
+        uploaded = await stream_rename(
+            helper, source, file_size, source, new_name, as_video,
+            thumb=thumb, caption=caption, progress=progress, share=share,
+            on_downloaded=on_downloaded
+        )
+        return await client.copy_message(
+            reply_to.chat.id,
+            Config.BIN_CHANNEL,
+            uploaded.id,
+            reply_to_message_id=reply_to.id
+        )
+    finally:
+        relay_ids = [relay.id] + ([uploaded.id] if uploaded else [])
+        try:
+            await client.delete_messages(Config.BIN_CHANNEL, relay_ids)
+        except Exception as e:
+            logger.warning(f"Failed to delete relay messages: {e}")
@@ -1,4 +1,5 @@
 import time
+import string
 import datetime
 import asyncio
 from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated, PeerIdInvalid
@@ -65,8 +66,16 @@ def get_size(size):
         size /= 1024.0
     return f"{size:.2f} {units[i]}"
 
+def render_name_template(template, **values):
+    """Fill a batch rename template such as '{title} S01E{index:02d}.{ext}'"""
+    for _, field, _, _ in string.Formatter().parse(template):
+        # Only plain placeholders - no {0}, {name.attr} or {name[key]}
+        if field is not None and field not in values:
+            raise ValueError(f"Unknown placeholder {{{field}}}")
+    return template.format(**values).strip()
+
 async def users_broadcast(user_id, message, pin):
-    """Broadcast message to user"""
+    """Broadcast message to user - FloodWait is raised to the caller's rate limiter"""
     try:
         if pin:
             await message.copy(chat_id=user_id)
@@ -74,9 +83,8 @@ async def users_broadcast(user_id, message, pin):
         else:
             await message.copy(chat_id=user_id)
             return True, "Success"
-    except FloodWait as e:
-        await asyncio.sleep(e.x)
-        return await users_broadcast(user_id, message, pin)
+    except FloodWait:
+        raise
     except UserIsBlocked:
         return False, "Blocked"
     except InputUserDeactivated: